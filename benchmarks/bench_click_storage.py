@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Database size of legacy per header click rows against header_data.
+
+    python -m benchmarks.bench_click_storage --views 1000000
+
+Views are seeded the old way, with one `headers` row per request header,
+then migrate_shrls_db packs them into views.header_data. With
+--recorded-headers-only only the shrls_recorded_headers among them are
+packed, which is what the click recorder stores for the same requests. The
+database is vacuumed and measured before and after the migration.
+Results are printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+# A typical browser request as seen behind the reverse proxy
+HEADERS = [
+    ('Host', 'example.com'),
+    ('X-Real-Ip', '203.0.113.{n}'),
+    ('X-Forwarded-For', '203.0.113.{n}'),
+    ('X-Forwarded-Proto', 'https'),
+    ('Connection', 'close'),
+    ('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64; rv:{n}.0) Gecko/20100101 Firefox/{n}.0'),
+    ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'),
+    ('Accept-Language', 'en-US,en;q=0.5'),
+    ('Accept-Encoding', 'gzip, deflate, br'),
+    ('Referer', 'https://news.example.org/item?id={n}'),
+    ('Dnt', '1'),
+    ('Upgrade-Insecure-Requests', '1'),
+    ('Sec-Fetch-Dest', 'document'),
+    ('Sec-Fetch-Mode', 'navigate'),
+    ('Sec-Fetch-Site', 'cross-site'),
+    ('Cookie', '_ga=GA1.2.{n}{n}{n}.1600000000'),
+]
+
+
+def database_size(engine, path):
+    with engine.connect() as conn:
+        conn.execute('VACUUM')
+        # In WAL mode the main file only shrinks once the WAL is written back
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=10000)
+    parser.add_argument('--views', type=int, default=1000000)
+    parser.add_argument('--recorded-headers-only', action='store_true')
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    from shrls import app
+    from shrls.models import engine, initialize_shrls_db, migrate_shrls_db, legacy_headers_table
+    from benchmarks.seed import seed, insert
+
+    app.config['shrls_migrate_recorded_headers_only'] = options.recorded_headers_only
+    initialize_shrls_db()
+    legacy_headers_table.create(bind=engine)
+    seed(engine, urls=options.urls, tags=0, views=options.views, headers_per_view=0, snippets=0)
+    rng = random.Random(1)
+    with engine.begin() as conn:
+        insert(conn, legacy_headers_table, ({
+            'views_id': i,
+            'key': key,
+            'value': value.format(n=rng.randint(1, 250)),
+        } for i in range(1, options.views + 1) for key, value in HEADERS), 20000)
+
+    path = os.path.join(workdir, 'urls.db')
+    results = {'before_bytes': database_size(engine, path)}
+    start = time.time()
+    migrate_shrls_db()
+    results['migrate_seconds'] = time.time() - start
+    results['after_bytes'] = database_size(engine, path)
+    results['ratio'] = float(results['after_bytes']) / results['before_bytes']
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Redirect lookups under concurrent writes with each engine profile.
+
+    python -m benchmarks.bench_concurrency --readers 8 --writers 2 --seconds 10
+
+For every profile a fresh database is seeded, then reader threads look up
+random aliases while writer threads insert urls and bump view counters in
+small transactions, like create_url and the click recorder do. The
+`default` profile is a plain create_engine with SQLite's rollback journal,
+`tuned` is the shrls engine profile with its read-only pool. Results are
+printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import datetime
+
+
+def run_profile(name, options, workdir):
+    from sqlalchemy import create_engine, select, bindparam
+    from sqlalchemy.exc import OperationalError
+    from shrls import app
+    from shrls.models import Base, Url, make_engine
+    from benchmarks.seed import seed, make_alias
+    from benchmarks.timing import summarize
+
+    uri = 'sqlite:///{}'.format(os.path.join(workdir, '{}.db'.format(name)))
+    if name == 'default':
+        engine = create_engine(uri, convert_unicode=True)
+        read_engine = engine
+    else:
+        profile = {
+            'pragmas': app.config['shrls_sqlite_pragmas'],
+            'pool_size': app.config['shrls_pool_size'],
+            'max_overflow': app.config['shrls_pool_max_overflow'],
+            'pool_timeout': app.config['shrls_pool_timeout'],
+        }
+        engine = make_engine(uri, **profile)
+        read_engine = make_engine(uri, read_only=True, **profile)
+    Base.metadata.create_all(bind=engine)
+    seed(engine, urls=options.urls, tags=10, views=0, headers_per_view=0, snippets=0)
+
+    urls = Url.__table__
+    lookup = select([urls.c.id, urls.c.location]).where(urls.c.alias == bindparam('lookup_alias'))
+    increment = urls.update().where(urls.c.id == bindparam('url_id')).values(views=urls.c.views + 1)
+    deadline = time.time() + options.seconds
+    results = {'reads': [], 'writes': [], 'errors': 0}
+    lock = threading.Lock()
+
+    def reader(seed_value):
+        rng = random.Random(seed_value)
+        samples = []
+        errors = 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                with read_engine.connect() as conn:
+                    conn.execute(lookup, lookup_alias=make_alias(rng.randint(1, options.urls))).fetchall()
+            except OperationalError:
+                errors += 1
+                continue
+            samples.append(time.time() - start)
+        with lock:
+            results['reads'].extend(samples)
+            results['errors'] += errors
+
+    def writer(seed_value):
+        rng = random.Random(seed_value)
+        samples = []
+        errors = 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(urls.insert(), {
+                        'alias': 'w{}'.format(rng.getrandbits(48)),
+                        'location': 'https://example.org/written',
+                        'views': 0,
+                        'created_at': datetime.datetime.now(),
+                    })
+                    conn.execute(increment, [{'url_id': rng.randint(1, options.urls)} for _ in range(10)])
+            except OperationalError:
+                errors += 1
+                continue
+            samples.append(time.time() - start)
+        with lock:
+            results['writes'].extend(samples)
+            results['errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(options.readers)]
+    threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(options.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    read_engine.dispose()
+
+    return {
+        'reads': dict(summarize(results['reads']), per_second=len(results['reads']) / options.seconds),
+        'writes': dict(summarize(results['writes']), per_second=len(results['writes']) / options.seconds),
+        'errors': results['errors'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    results = {}
+    for name in ['default', 'tuned']:
+        results[name] = run_profile(name, options, workdir)
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
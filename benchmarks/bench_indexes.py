@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Redirect, tag redirect and info lookups with and without indexes.
+
+    python -m benchmarks.bench_indexes --urls 1000000 --views 50000000
+
+The database is seeded without the secondary indexes, timed, upgraded
+with migrate_shrls_db and timed again. Results are printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+
+def measure(options):
+    from sqlalchemy import desc
+    from shrls.headers import header_codec
+    from shrls.models import DBSession, Url, Tag, View
+    from benchmarks.seed import make_alias
+    from benchmarks.timing import timed
+
+    rng = random.Random(1)
+
+    def redirect(alias):
+        DBSession.query(Url.id, Url.location).filter(Url.alias == alias).all()
+        DBSession.remove()
+
+    def tag_redirect(name):
+        tag = DBSession.query(Tag).filter(Tag.name == name).first()
+        if tag:
+            [url.alias for url in tag.urls]
+        DBSession.remove()
+
+    def info(alias):
+        for url in DBSession.query(Url).filter(Url.alias == alias):
+            for view in url.requests.order_by(desc(View.timestamp)).limit(25):
+                header_codec.decode(view.header_data)
+        DBSession.remove()
+
+    aliases = [make_alias(rng.randint(1, options.urls)) for _ in range(options.lookups)]
+    tags = ['tag{}'.format(rng.randint(1, options.tags)) for _ in range(options.lookups)]
+    return {
+        'url_redirect': timed(redirect, aliases),
+        'return_tagged_url': timed(tag_redirect, tags),
+        'url_info': timed(info, aliases[:max(1, options.lookups // 10)]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--views', type=int, default=50000000)
+    parser.add_argument('--tags', type=int, default=1000)
+    parser.add_argument('--headers-per-view', type=int, default=0)
+    parser.add_argument('--lookups', type=int, default=100)
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    from shrls.models import engine, initialize_shrls_db, migrate_shrls_db
+    from benchmarks.seed import seed
+
+    initialize_shrls_db()
+    with engine.begin() as conn:
+        for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND name LIKE 'ix_%' AND name != 'ix_snippets_alias'").fetchall():
+            conn.execute('DROP INDEX {}'.format(name))
+
+    start = time.time()
+    seed(engine, urls=options.urls, tags=options.tags, views=options.views,
+         headers_per_view=options.headers_per_view, snippets=0)
+    results = {'seed_seconds': time.time() - start}
+    results['without_indexes'] = measure(options)
+    start = time.time()
+    migrate_shrls_db()
+    results['migrate_seconds'] = time.time() - start
+    results['with_indexes'] = measure(options)
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Admin search latency with the ILIKE scan and the FTS5 index.
+
+    python -m benchmarks.bench_search --urls 1000000
+
+Each search is run through get_shrls_api's query (first page of 50 urls
+ordered by created_at) with LikeSearchIndex and Fts5SearchIndex. Results
+are printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+SEARCHES = [
+    'docs',
+    '#tag12',
+    '/status',
+    'video -blog',
+    '#tag3 build',
+    '{alias}',
+    '/{alias}',
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--tags', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    from shrls.models import DBSession, Url, engine, initialize_shrls_db
+    from shrls.search import LikeSearchIndex, Fts5SearchIndex, parse_search
+    from benchmarks.seed import seed, make_alias
+    from benchmarks.timing import timed
+
+    initialize_shrls_db()
+    start = time.time()
+    seed(engine, urls=options.urls, tags=options.tags, views=0, snippets=0)
+    results = {'seed_seconds': time.time() - start, 'searches': {}}
+
+    rng = random.Random(1)
+    for search in SEARCHES:
+        searches = [search.format(alias=make_alias(rng.randint(1, options.urls))[:4])
+                    for _ in range(options.repeat)]
+        results['searches'][search] = {}
+        for index in [LikeSearchIndex(), Fts5SearchIndex()]:
+            def run(s):
+                query = DBSession.query(Url).order_by(Url.created_at.desc())
+                index.filter(query, parse_search([s])).limit(50).all()
+                DBSession.remove()
+            results['searches'][search][type(index).__name__] = timed(run, searches)
+
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
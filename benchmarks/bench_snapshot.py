@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Alias lookups from the database against the mmap alias snapshot.
+
+    python -m benchmarks.bench_snapshot --urls 1000000
+
+Times building the snapshot, then resolves random aliases with
+find_redirect_candidates three ways: from the database with the alias
+cache cleared before every lookup, through a warm alias cache and from the
+snapshot. Every snapshot answer is checked against the database. Results
+are printed as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    from shrls import app
+    from shrls.cache import alias_cache
+    from shrls.models import ReadSession, engine, initialize_shrls_db
+    from shrls.snapshot import alias_snapshot, build_snapshot
+    from shrls.views import find_redirect_candidates
+    from benchmarks.seed import seed, make_alias
+    from benchmarks.timing import timed
+
+    initialize_shrls_db()
+    start = time.time()
+    seed(engine, urls=options.urls, views=0, snippets=0)
+    results = {'seed_seconds': time.time() - start}
+
+    path = os.path.join(workdir, 'aliases.snapshot')
+    start = time.time()
+    results['snapshot_aliases'] = build_snapshot(engine, path)
+    results['snapshot_seconds'] = time.time() - start
+    results['snapshot_bytes'] = os.path.getsize(path)
+
+    rng = random.Random(1)
+    aliases = [make_alias(rng.randint(1, options.urls)) for _ in range(options.lookups)]
+
+    def database(alias):
+        alias_cache.clear()
+        find_redirect_candidates(alias)
+        ReadSession.remove()
+
+    def cached(alias):
+        find_redirect_candidates(alias)
+        ReadSession.remove()
+
+    alias_snapshot.path = None
+    results['database'] = timed(database, aliases)
+    cached_aliases = list(set(aliases))[:app.config['shrls_alias_cache_size']]
+    for alias in cached_aliases:
+        cached(alias)
+    results['alias_cache'] = timed(cached, cached_aliases)
+    expected = {}
+    for alias in aliases[:1000]:
+        alias_cache.clear()
+        expected[alias] = sorted(find_redirect_candidates(alias))
+    ReadSession.remove()
+
+    alias_snapshot.path = path
+    alias_snapshot._checked = None
+    results['snapshot'] = timed(find_redirect_candidates, aliases)
+    mismatches = [alias for alias, candidates in expected.items()
+                  if sorted(alias_snapshot.get(alias) or ()) != candidates]
+    results['mismatches'] = len(mismatches)
+
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
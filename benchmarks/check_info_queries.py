@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Check that the admin info endpoints run a constant number of queries.
+
+    python -m benchmarks.check_info_queries
+
+Each endpoint is requested with a small and a large page of views over
+urls with several tags, including an alias shared by several urls. The
+number of SQL statements must not grow with the page size or exceed
+--max-queries, otherwise the script exits with status 1. The same bound
+is asserted by tests/test_info_queries.py on every test run.
+"""
+
+import os
+import sys
+import json
+import base64
+import argparse
+import tempfile
+
+
+def count_queries(client, path, headers):
+    from sqlalchemy import event
+    from shrls.models import engine
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(path, headers=headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    if response.status_code != 200:
+        raise RuntimeError('{} returned {}'.format(path, response.status_code))
+    return len(statements)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=500)
+    parser.add_argument('--views', type=int, default=5000)
+    parser.add_argument('--large-page', type=int, default=200)
+    parser.add_argument('--max-queries', type=int, default=5)
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    from shrls import app
+    from shrls.models import engine, initialize_shrls_db, Url
+    from benchmarks.seed import seed, make_alias
+
+    app.config['shrls_users'] = [{'shrls_username': 'bench', 'shrls_password': 'bench'}]
+    initialize_shrls_db()
+    seed(engine, urls=options.urls, tags=10, tags_per_url=4, views=options.views, headers_per_view=3, snippets=0)
+    shared = make_alias(1)
+    with engine.begin() as conn:
+        conn.execute(Url.__table__.update().where(Url.__table__.c.id.in_([2, 3, 4])).values(alias=shared))
+
+    import shrls.views  # noqa: F401 registers the routes
+    client = app.test_client()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(b'bench:bench').decode('ascii')}
+
+    results = {}
+    failed = False
+    for path in ['/admin/info/', '/admin/info/' + shared]:
+        # Warm up the header name lookup so only the endpoint is counted
+        client.get(path, headers=headers)
+        counts = {
+            size: count_queries(client, '{}?count={}'.format(path, size), headers)
+            for size in [1, options.large_page]
+        }
+        results[path] = counts
+        if counts[options.large_page] > counts[1] or max(counts.values()) > options.max_queries:
+            failed = True
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    results['ok'] = not failed
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Synthetic data for the shrls benchmarks."""
+
+import json
+import random
+import datetime
+
+from shrls.bulk import reset_id_sequence
+from shrls.models import (
+    Url,
+    Tag,
+    Snippet,
+    View,
+    allowed_shortner_chars,
+    intern_header_names,
+    tags_to_urls_table,
+)
+
+WORDS = ['docs', 'blog', 'status', 'wiki', 'search', 'video', 'repo', 'issue', 'build', 'chat']
+
+
+def make_alias(n, length=6):
+    n = (n * 1000003) % (len(allowed_shortner_chars) ** length)
+    alias = []
+    for _ in range(length):
+        n, r = divmod(n, len(allowed_shortner_chars))
+        alias.append(allowed_shortner_chars[r])
+    return ''.join(alias)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert(conn, table, rows, chunk_size):
+    for chunk in chunked(rows, chunk_size):
+        conn.execute(table.insert(), chunk)
+
+
+def seed(bind, urls=1000, tags=100, tags_per_url=2, views=10000,
+         headers_per_view=2, snippets=100, chunk_size=20000, random_seed=0):
+    """Fill an empty shrls database with synthetic rows.
+
+    Url ids run from 1 to `urls` and their aliases are `make_alias(id)`,
+    tags are named `tag<n>`, so benchmarks can pick targets without
+    querying for them.
+    """
+    rng = random.Random(random_seed)
+    now = datetime.datetime.now()
+    with bind.begin() as conn:
+        insert(conn, Tag.__table__, ({
+            'id': i,
+            'name': 'tag{}'.format(i),
+            'created_at': now,
+        } for i in range(1, tags + 1)), chunk_size)
+        insert(conn, Url.__table__, ({
+            'id': i,
+            'alias': make_alias(i),
+            'location': 'https://example.org/{}/{}'.format(rng.choice(WORDS), i),
+            'views': 0,
+            'created_at': now - datetime.timedelta(seconds=urls - i),
+        } for i in range(1, urls + 1)), chunk_size)
+        if tags:
+            insert(conn, tags_to_urls_table, ({
+                'tag_id': tag_id,
+                'url_id': i,
+            } for i in range(1, urls + 1)
+              for tag_id in set(rng.randint(1, tags) for _ in range(tags_per_url))), chunk_size)
+        insert(conn, Snippet.__table__, ({
+            'id': i,
+            'alias': 's' + make_alias(i),
+            'title': 'Snippet {}'.format(i),
+            'content': '\n'.join('line {} of snippet {}'.format(n, i) for n in range(40)),
+            'views': 0,
+            'created_at': now,
+        } for i in range(1, snippets + 1)), chunk_size)
+    start = now - datetime.timedelta(days=365)
+    with bind.begin() as conn:
+        names = intern_header_names(conn, ['Header-{}'.format(n) for n in range(headers_per_view)], {})
+        header_data = json.dumps({
+            str(names['Header-{}'.format(n)]): 'value {}'.format(n) for n in range(headers_per_view)
+        }, separators=(',', ':')) if headers_per_view else None
+        if urls:
+            insert(conn, View.__table__, ({
+                'id': i,
+                'urls_id': rng.randint(1, urls),
+                'timestamp': start + datetime.timedelta(seconds=i * 31536000.0 / views),
+                'ip': '10.0.{}.{}'.format(i % 256, (i // 256) % 256),
+                'request': 'http://example.com/',
+                'header_data': header_data,
+            } for i in range(1, views + 1)), chunk_size)
+    with bind.begin() as conn:
+        for table in [Tag.__table__, Url.__table__, Snippet.__table__, View.__table__]:
+            reset_id_sequence(conn, table)
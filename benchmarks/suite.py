@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Latency and throughput of the shrls routes.
+
+    python -m benchmarks --urls 100000 --views 1000000 --output results.json
+    python -m benchmarks --compare results.json
+
+A synthetic database is seeded in --workdir (or SHRLS_DATABASE_URI), then
+every route is driven through the Flask test client, one request at a
+time, and through a local threaded WSGI server with --concurrency
+clients. Each reports p50/p99 latency and requests per second. With
+--compare the ratios against an earlier result file are added, so hot path
+regressions show up between versions. Results are printed as JSON.
+
+The focused micro benchmarks (bench_indexes, bench_search,
+bench_click_storage, bench_concurrency) and check_info_queries stay
+separate modules in this package.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+from benchmarks.timing import summarize
+
+ROUTES = [
+    'url_redirect',
+    'return_tagged_url',
+    'render_code_snippet',
+    'get_shrls_api_search',
+    'backup',
+    'restore',
+]
+# Routes that read or write the whole database run fewer times
+HEAVY_ROUTES = ['backup', 'restore']
+SEARCHES = ['docs', '#tag3', 'video -blog', '/status']
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+class Requests(object):
+    """Builds (method, path, headers, body) requests for each route."""
+
+    def __init__(self, options, backup_body=None):
+        from benchmarks.seed import make_alias
+        self.options = options
+        self.make_alias = make_alias
+        self.backup_body = backup_body
+        self.auth = {'Authorization': 'Basic ' + base64.b64encode(
+            '{}:{}'.format(USERNAME, PASSWORD).encode('utf-8')).decode('ascii')}
+        self.client_headers = {'X-Real-Ip': '203.0.113.7', 'X-Forwarded-For': '203.0.113.7',
+                               'User-Agent': 'shrls-bench/1.0'}
+
+    def build(self, route, rng):
+        if route == 'url_redirect':
+            alias = self.make_alias(rng.randint(1, self.options.urls))
+            return 'GET', '/' + alias, self.client_headers, None
+        if route == 'return_tagged_url':
+            return 'GET', '/t/tag{}'.format(rng.randint(1, self.options.tags)), self.client_headers, None
+        if route == 'render_code_snippet':
+            alias = 's' + self.make_alias(rng.randint(1, self.options.snippets))
+            return 'GET', '/c/' + alias, self.client_headers, None
+        if route == 'get_shrls_api_search':
+            return 'GET', '/admin/api/shrls?search=' + rng.choice(SEARCHES).replace(' ', '+'), self.auth, None
+        if route == 'backup':
+            return 'GET', '/admin/backup/?format=ndjson', self.auth, None
+        if route == 'restore':
+            return 'POST', '/admin/restore/', self.auth, self.backup_body
+        raise ValueError(route)
+
+
+def multipart(body):
+    boundary = 'shrls-bench-boundary'
+    payload = (
+        '--{0}\r\nContent-Disposition: form-data; name="file"; filename="backup.ndjson"\r\n'
+        'Content-Type: application/x-ndjson\r\n\r\n'.format(boundary).encode('utf-8')
+        + body + '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+    )
+    return payload, 'multipart/form-data; boundary={}'.format(boundary)
+
+
+def run_client(app, requests, route, count, seed):
+    client = app.test_client()
+    rng = random.Random(seed)
+    samples = []
+    errors = 0
+    start = time.time()
+    for _ in range(count):
+        method, path, headers, body = requests.build(route, rng)
+        began = time.time()
+        if body is not None:
+            response = client.open(path, method=method, headers=headers,
+                                   data={'file': (io.BytesIO(body), 'backup.ndjson')})
+        else:
+            response = client.open(path, method=method, headers=headers)
+        response.get_data()
+        samples.append(time.time() - began)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.time() - start
+    return dict(summarize(samples), per_second=len(samples) / elapsed, errors=errors)
+
+
+def run_server(port, requests, route, count, concurrency, seed):
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(n, share):
+        rng = random.Random(seed + n)
+        local = []
+        failed = 0
+        for _ in range(share):
+            method, path, headers, body = requests.build(route, rng)
+            headers = dict(headers)
+            if body is not None:
+                body, headers['Content-Type'] = multipart(body)
+            began = time.time()
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=300)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (IOError, httplib.HTTPException):
+                failed += 1
+            finally:
+                conn.close()
+            local.append(time.time() - began)
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    shares = [count // concurrency + (1 if n < count % concurrency else 0) for n in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(n, share)) for n, share in enumerate(shares) if share]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return dict(summarize(samples), per_second=len(samples) / elapsed, errors=errors[0])
+
+
+@contextlib.contextmanager
+def local_server(app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server.server_port
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def compare(results, baseline):
+    """Ratios of the current p50, p99 and throughput to `baseline`."""
+    ratios = {}
+    for driver in ['client', 'server']:
+        for route, current in results.get(driver, {}).items():
+            previous = baseline.get(driver, {}).get(route)
+            if not previous:
+                continue
+            ratios.setdefault(driver, {})[route] = {
+                key: current[key] / previous[key] if previous.get(key) else None
+                for key in ['p50_ms', 'p99_ms', 'per_second']
+                if current.get(key) is not None
+            }
+    return ratios
+
+
+def measure(options):
+    from shrls import app
+    from shrls.models import engine, initialize_shrls_db
+    from shrls.backup import buffered, iter_backup_ndjson
+    from shrls.recorder import click_recorder
+    from benchmarks.seed import seed
+
+    app.config['shrls_users'] = [{'shrls_username': USERNAME, 'shrls_password': PASSWORD,
+                                  'shrls_admin': True}]
+    initialize_shrls_db()
+    start = time.time()
+    seed(engine, urls=options.urls, tags=options.tags, views=options.views,
+         headers_per_view=options.headers_per_view, snippets=options.snippets)
+    results = {'seed_seconds': time.time() - start, 'client': {}, 'server': {}}
+
+    backup_body = b''.join(buffered(iter_backup_ndjson(engine)))
+    requests = Requests(options, backup_body)
+    routes = options.routes or ROUTES
+    for route in routes:
+        count = options.heavy_requests if route in HEAVY_ROUTES else options.requests
+        results['client'][route] = run_client(app, requests, route, count, options.seed)
+    with local_server(app) as port:
+        for route in routes:
+            count = options.heavy_requests if route in HEAVY_ROUTES else options.requests
+            results['server'][route] = run_server(port, requests, route, count, options.concurrency,
+                                                  options.seed)
+    click_recorder.flush()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=100000)
+    parser.add_argument('--tags', type=int, default=1000)
+    parser.add_argument('--views', type=int, default=1000000)
+    parser.add_argument('--headers-per-view', type=int, default=4)
+    parser.add_argument('--snippets', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--heavy-requests', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', nargs='+', choices=ROUTES)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--workdir', default=None)
+    options = parser.parse_args(argv)
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='shrls-bench-')
+    os.chdir(workdir)
+    stdout = sys.stdout
+    # Keep anything the app prints out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        results = measure(options)
+    if options.compare:
+        with open(options.compare) as baseline:
+            results['compared_to'] = compare(results, json.load(baseline))
+    results['options'] = vars(options)
+    results['options']['workdir'] = workdir
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    json.dump(results, stdout, indent=2, sort_keys=True)
+    stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
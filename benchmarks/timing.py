@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds of a list of durations in seconds."""
+    samples = [sample * 1000 for sample in samples]
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+        'mean_ms': sum(samples) / len(samples) if samples else None,
+    }
+
+
+def timed(fn, args):
+    samples = []
+    for arg in args:
+        start = time.time()
+        fn(arg)
+        samples.append(time.time() - start)
+    return summarize(samples)
@@ -14,8 +14,18 @@ setup(
         'sqlalchemy',
         'oath',
     ],
+    extras_require={
+        'postgres': ['psycopg2'],
+        'asgi': ['uvicorn'],
+        'test': ['pytest', 'psycopg2-binary', 'pgserver; python_version >= "3.9"'],
+    },
     entry_points="""\
     [console_scripts]
     initialize_shrls_db = shrls.models:initialize_shrls_db
+    migrate_shrls_db = shrls.models:migrate_shrls_db
+    restore_shrls_db = shrls.backup:restore_command
+    backfill_shrls_rollups = shrls.stats:backfill_command
+    archive_shrls_views = shrls.retention:archive_command
+    build_alias_snapshot = shrls.snapshot:snapshot_command
     """,
 )
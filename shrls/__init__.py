@@ -3,28 +3,126 @@
 
 import os
 import random
+from collections import OrderedDict
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
+from shrls.logs import buffer_logging
+
 app = Flask(__name__, static_url_path='/static')
 app.config['SECRET_KEY'] = str(random.random())
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////%s/urls.db' % os.getcwd()
+# Database for redirect lookups, e.g. a read replica. Defaults to the above
+app.config['shrls_read_database_uri'] = None
+# Extra keyword arguments for create_engine
+app.config['shrls_engine_options'] = {}
 app.config['UPLOAD_FOLDER'] = '%s/uploads/' % os.getcwd()
 
+# Run on every new SQLite connection, in order
+app.config['shrls_sqlite_pragmas'] = OrderedDict([
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 268435456),
+    ('cache_size', -20000),
+])
+app.config['shrls_pool_size'] = 10
+app.config['shrls_pool_max_overflow'] = 20
+app.config['shrls_pool_timeout'] = 30
+app.config['shrls_read_only_pool'] = True
+
 app.config['shrls_username'] = 'admin'
 app.config['shrls_password'] = 'changemenow'
+# Seconds a successful admin login is trusted without checking credentials
+app.config['shrls_auth_ttl'] = 3600
 
 app.config['shrls_redirect_unknown'] = True
 app.config['shrls_redirect_url'] = 'http://example.com/'
 app.config['shrls_base_url'] = 'http://example.com/'
+app.config['shrls_max_redirect_hops'] = 10
+
+app.config['shrls_alias_cache_size'] = 10000
+app.config['shrls_alias_cache_ttl'] = 300
+app.config['shrls_snippet_cache_size'] = 1000
+# File written by build_alias_snapshot, looked in before the database
+app.config['shrls_alias_snapshot'] = None
+# Seconds between checks for a newly published snapshot
+app.config['shrls_alias_snapshot_check_interval'] = 5.0
+
+app.config['shrls_alias_min_length'] = 5
+app.config['shrls_alias_block_size'] = 100
+app.config['shrls_alias_density'] = 0.5
+
+app.config['shrls_click_recorder_async'] = True
+app.config['shrls_click_queue_size'] = 10000
+app.config['shrls_click_batch_size'] = 500
+app.config['shrls_click_flush_interval'] = 1.0
+app.config['shrls_click_rollups'] = True
+# Longest period /admin/api/stats reports on, in days
+app.config['shrls_stats_max_days'] = 3660
+# Raw clicks older than this many days are moved to the archive, None keeps them
+app.config['shrls_view_retention_days'] = None
+app.config['shrls_archive_folder'] = '%s/archive/' % os.getcwd()
+app.config['shrls_archive_segment_size'] = 100000
+app.config['shrls_archive_batch_size'] = 500
+app.config['shrls_archive_pause'] = 0.05
+app.config['shrls_view_counter_shards'] = 16
+app.config['shrls_view_counter_flush_interval'] = 1.0
+# Request headers kept for every click, None keeps all of them
+app.config['shrls_recorded_headers'] = [
+    'Accept-Language',
+    'Host',
+    'Referer',
+    'User-Agent',
+    'X-Forwarded-For',
+    'X-Real-Ip',
+]
+# migrate_shrls_db keeps every header of clicks stored before header_data,
+# set this to keep only the shrls_recorded_headers and drop the rest for good
+app.config['shrls_migrate_recorded_headers_only'] = False
+
+app.config['shrls_search_index'] = 'fts5'
+
+app.config['shrls_log_level'] = 'INFO'
+# Write log records from a background thread instead of the request
+app.config['shrls_log_buffered'] = True
+# Log requests slower than this many seconds with their SQL, None disables it
+app.config['shrls_slow_request_seconds'] = None
+app.config['shrls_upload_max_size'] = 100 * 1024 * 1024
+# How long /u/<name>?v=<digest> may be cached, /u/<name> is revalidated every time
+app.config['shrls_upload_cache_seconds'] = 365 * 24 * 3600
+# Urls created per transaction by /admin/api/shrls/bulk
+app.config['shrls_bulk_batch_size'] = 1000
+# Lookups running at once in each shrls.asgi redirect worker
+app.config['shrls_asgi_threads'] = 16
+
+# A python file of overrides for any of the above, then the environment.
+# Unlike Config.from_envvar this keeps the lower case shrls_ settings.
+if os.environ.get('SHRLS_SETTINGS'):
+    settings = {}
+    with open(os.environ['SHRLS_SETTINGS']) as settings_file:
+        exec(compile(settings_file.read(), os.environ['SHRLS_SETTINGS'], 'exec'), settings)
+    app.config.update((key, value) for key, value in settings.items() if not key.startswith('_'))
+for key, name in [('SQLALCHEMY_DATABASE_URI', 'SHRLS_DATABASE_URI'),
+                  ('shrls_read_database_uri', 'SHRLS_READ_DATABASE_URI'),
+                  ('UPLOAD_FOLDER', 'SHRLS_UPLOAD_FOLDER'),
+                  ('shrls_archive_folder', 'SHRLS_ARCHIVE_FOLDER'),
+                  ('shrls_alias_snapshot', 'SHRLS_ALIAS_SNAPSHOT')]:
+    if os.environ.get(name):
+        app.config[key] = os.environ[name]
 
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+app.logger.setLevel(app.config['shrls_log_level'])
+if app.config['shrls_log_buffered']:
+    buffer_logging(app.logger)
+
 import shrls.views
-from shrls.models import DBSession
+from shrls.models import DBSession, ReadSession
 
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     DBSession.remove()
+    ReadSession.remove()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import threading
+
+from sqlalchemy import select, union, exists, func, exc
+
+# Feistel rounds of the keyed permutation of counter values
+ROUNDS = 4
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity):
+        # 9.6 bits and 7 hashes per entry give a 1% false positive rate
+        self.size = max(8192, int(capacity * 9.6))
+        self.hashes = 7
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.md5(value.encode('utf-8')).digest()
+        a = int.from_bytes(digest[:8], 'little')
+        b = int.from_bytes(digest[8:], 'little') | 1
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class AliasAllocator(object):
+    """Hands out unused short aliases without querying per attempt.
+
+    Aliases come from a shared counter stored in `sequence`. Each process
+    reserves `block_size` counter values per database round trip and maps
+    every value to a distinct alias with a permutation of the space of
+    `length` characters, keyed by a random secret kept in the same row.
+    Without the secret consecutive aliases look unrelated, so one alias
+    does not give away the others. Once `density` of that space has been
+    handed out the length grows by one.
+
+    Aliases that were not allocated here (random legacy aliases and custom
+    ones) are tracked in a bloom filter loaded from `columns` on the first
+    allocation and after reset(). Only a bloom filter hit costs a query, to
+    confirm the collision. The filter is per process: add() only reaches
+    the process it is called in, so a custom alias created by another
+    worker or node after the load is not seen, and could be handed out
+    again until the next reset().
+    """
+
+    def __init__(self, bind, sequence, columns, alphabet, min_length=5, block_size=100, density=0.5):
+        self.bind = bind
+        self.sequence = sequence
+        self.columns = columns
+        self.alphabet = alphabet
+        self.min_length = min_length
+        self.block_size = block_size
+        self.density = density
+        self._next = 0
+        self._end = 0
+        self._known = None
+        self._secret = None
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            while True:
+                alias = self.encode(self._take())
+                if not self._is_taken(alias):
+                    return alias
+
+    def allocate_many(self, count):
+        """Allocate `count` aliases, reserving all their counter values at once."""
+        aliases = []
+        with self._lock:
+            while len(aliases) < count:
+                if self._next >= self._end:
+                    self._next, self._end = self._reserve(max(self.block_size, count - len(aliases)))
+                alias = self.encode(self._take())
+                if not self._is_taken(alias):
+                    aliases.append(alias)
+        return aliases
+
+    def add(self, alias):
+        """Remember an alias that was chosen by hand."""
+        with self._lock:
+            if self._known is not None and alias:
+                self._known.add(alias)
+
+    def reset(self):
+        """Reload the known aliases on the next allocation."""
+        with self._lock:
+            self._known = None
+
+    def encode(self, value):
+        base = len(self.alphabet)
+        length = self.min_length
+        while value >= int(base ** length * self.density):
+            value -= int(base ** length * self.density)
+            length += 1
+        value = self._permute(value, base ** length)
+        alias = []
+        for _ in range(length):
+            value, r = divmod(value, base)
+            alias.append(self.alphabet[r])
+        return ''.join(alias)
+
+    def _permute(self, value, space):
+        # A balanced Feistel network over the smallest even number of bits
+        # covering the space, walking the cycle until the result fits
+        half = ((space - 1).bit_length() + 1) // 2
+        mask = (1 << half) - 1
+        while True:
+            left, right = value >> half, value & mask
+            for round_number in range(ROUNDS):
+                left, right = right, left ^ (self._round(round_number, half, right) & mask)
+            value = (left << half) | right
+            if value < space:
+                return value
+
+    def _round(self, round_number, half, value):
+        digest = hashlib.blake2b(
+            '{}:{}:{}'.format(round_number, half, value).encode('ascii'),
+            key=self._secret, digest_size=8,
+        ).digest()
+        return int.from_bytes(digest, 'little')
+
+    def _take(self):
+        if self._next >= self._end:
+            self._next, self._end = self._reserve()
+        value = self._next
+        self._next += 1
+        return value
+
+    def _reserve(self, size=None):
+        size = size or self.block_size
+        sequence = self.sequence
+        for _ in range(3):
+            try:
+                with self.bind.begin() as conn:
+                    updated = conn.execute(
+                        sequence.update()
+                        .where(sequence.c.id == 1)
+                        .values(next_value=sequence.c.next_value + size)
+                    ).rowcount
+                    if not updated:
+                        conn.execute(sequence.insert().values(id=1, next_value=size))
+                    # Installs from before the secret get one on first use
+                    conn.execute(
+                        sequence.update()
+                        .where(sequence.c.id == 1)
+                        .where(sequence.c.secret.is_(None))
+                        .values(secret=os.urandom(32).hex())
+                    )
+                    end, secret = conn.execute(
+                        select([sequence.c.next_value, sequence.c.secret]).where(sequence.c.id == 1)
+                    ).first()
+                self._secret = bytes.fromhex(secret)
+                return end - size, end
+            except exc.IntegrityError:
+                # Another process created the counter row first
+                continue
+        raise RuntimeError('Unable to reserve a block of aliases')
+
+    def _load(self):
+        query = union(*[select([column.label('alias')]) for column in self.columns])
+        with self.bind.connect() as conn:
+            count = conn.execute(select([func.count()]).select_from(query.alias())).scalar()
+            known = BloomFilter(count * 2)
+            for (alias,) in conn.execution_options(stream_results=True).execute(query):
+                if alias:
+                    known.add(alias)
+        return known
+
+    def _is_taken(self, alias):
+        if self._known is None:
+            self._known = self._load()
+        if alias not in self._known:
+            return False
+        with self.bind.connect() as conn:
+            return any(conn.execute(select([
+                exists().where(column == alias) for column in self.columns
+            ])).first())
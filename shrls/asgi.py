@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Redirect only ASGI application.
+
+    uvicorn shrls.asgi:application --workers 4
+
+Answers `/<alias>`, `/t/<tag>` and `/c/<alias>` like the Flask views and
+404s everything else, so admin traffic keeps going to the Flask app. The
+event loop only parses requests and writes responses. Lookups go through
+the views helpers and their caches on a small thread pool, and clicks are
+queued for the click recorder and view counters, which write them from
+their own threads.
+"""
+
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags
+from werkzeug.urls import url_quote
+from werkzeug.utils import redirect
+from werkzeug.wrappers import Response
+
+from shrls import app
+from shrls.counters import view_counters
+from shrls.models import DBSession, ReadSession
+from shrls.recorder import click_recorder
+from shrls.views import (
+    SNIPPET_FORMATS,
+    find_redirect_candidates,
+    lookup_tag,
+    remove_extra_redirects,
+    render_snippet,
+)
+
+
+def not_found():
+    if app.config['shrls_redirect_unknown']:
+        return redirect(app.config['shrls_redirect_url'], code=302)
+    return Response('File not found', 404, mimetype='text/html')
+
+
+class Request(object):
+    """The parts of an ASGI http scope the redirect views need."""
+
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.headers = [(name.decode('latin-1').title(), value.decode('latin-1'))
+                        for name, value in scope['headers']]
+        headers = dict((name.lower(), value) for name, value in self.headers)
+        host = headers.get('host')
+        if not host and scope.get('server'):
+            host = '{}:{}'.format(*scope['server'])
+        client = scope.get('client') or ('', 0)
+        self.ip = headers.get('x-real-ip', client[0])
+        self.if_none_match = parse_etags(headers.get('if-none-match'))
+        self.url = '{}://{}{}'.format(
+            scope.get('scheme', 'http'), host, url_quote(scope.get('root_path', '') + scope['path'], safe='/:'))
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        if query_string:
+            self.url += '?' + query_string
+
+
+def url_redirect(request, url_id):
+    extras = request.url.split('?')[1:]
+    candidates = find_redirect_candidates(url_id)
+    if not candidates:
+        return not_found()
+    redirect_id, location = random.choice(candidates)
+    click_recorder.record(redirect_id, request.ip, request.url, request.headers)
+    if extras:
+        if not extras[0].startswith('/'):
+            location += '/'
+        location += extras[0]
+    return redirect(location, code=302)
+
+
+def return_tagged_url(request, tagname):
+    aliases = lookup_tag(tagname)
+    if not aliases:
+        return not_found()
+    location = '{}/{}'.format(app.config['shrls_base_url'], random.choice(aliases))
+    return redirect(remove_extra_redirects(location), code=302)
+
+
+def render_code_snippet(request, url_id):
+    url_parts = url_id.split('.')
+    file_format = url_parts[-1].lower() if len(url_parts) > 1 else None
+    kind = SNIPPET_FORMATS.get(file_format)
+    if not kind:
+        return not_found()
+    # Templates need an application context
+    with app.app_context():
+        rendered = render_snippet(url_parts[0], kind)
+    if not rendered:
+        return not_found()
+    snippet_id, body, content_type, etag = rendered
+    view_counters.hit_snippet(snippet_id)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, content_type=content_type)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def index(request):
+    return not_found()
+
+
+# Endpoints of the Flask url map served here, any other match is a 404
+VIEWS = {
+    'index': index,
+    'url_redirect': url_redirect,
+    'return_tagged_url': return_tagged_url,
+    'render_code_snippet': render_code_snippet,
+}
+
+
+def dispatch(scope):
+    """Route and answer one request on a pool thread, returning a Response."""
+    try:
+        request = Request(scope)
+        adapter = app.url_map.bind('localhost')
+        try:
+            endpoint, arguments = adapter.match(scope['path'], method=request.method)
+        except HTTPException:
+            return Response('File not found', 404, mimetype='text/html')
+        view = VIEWS.get(endpoint)
+        if view is None:
+            return Response('File not found', 404, mimetype='text/html')
+        return view(request, **arguments)
+    except Exception:
+        app.logger.exception('Unable to serve %s', scope['path'])
+        return Response('Internal Server Error', 500, mimetype='text/html')
+    finally:
+        ReadSession.remove()
+        DBSession.remove()
+
+
+class RedirectApplication(object):
+    """ASGI application serving the redirect views from a thread pool.
+
+    `threads` bounds the lookups running at once and should stay within
+    the database pool, shrls_pool_size plus shrls_pool_max_overflow.
+    """
+
+    def __init__(self, threads=16):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='shrls-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(self.executor, dispatch, scope)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.to_wsgi_list()],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'' if scope['method'] == 'HEAD' else response.get_data(),
+        })
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_event_loop().run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        """Finish running lookups, then write out the queued clicks and counts."""
+        self.executor.shutdown(wait=True)
+        click_recorder.stop()
+        view_counters.stop()
+
+
+application = RedirectApplication(threads=app.config['shrls_asgi_threads'])
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+import json
+import zlib
+import codecs
+import argparse
+import datetime
+
+from sqlalchemy import select
+
+from shrls.bulk import upsert_urls, upsert_snippets
+from shrls.models import (
+    engine,
+    Url,
+    Tag,
+    Snippet,
+    tags_to_urls_table,
+)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_timestamp(value):
+    if not value:
+        return 0
+    return (value - EPOCH).total_seconds()
+
+
+def from_timestamp(value):
+    return EPOCH + datetime.timedelta(seconds=value or 0)
+
+
+def iter_pages(bind, table, columns, page_size):
+    """Yield lists of rows from `table` in id order, one query per page.
+
+    Each page is read on its own connection so the export never holds a
+    read transaction open across the whole table.
+    """
+    last_id = None
+    while True:
+        query = select(columns).order_by(table.c.id).limit(page_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        with bind.connect() as conn:
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield conn, rows
+
+
+def iter_urls(bind, page_size=1000):
+    urls = Url.__table__
+    columns = [urls.c.id, urls.c.alias, urls.c.location, urls.c.views, urls.c.created_at]
+    for conn, rows in iter_pages(bind, urls, columns, page_size):
+        tags = {row.id: [] for row in rows}
+        tag_rows = conn.execute(
+            select([tags_to_urls_table.c.url_id, Tag.__table__.c.name])
+            .select_from(tags_to_urls_table.join(
+                Tag.__table__, Tag.__table__.c.id == tags_to_urls_table.c.tag_id
+            ))
+            .where(tags_to_urls_table.c.url_id.in_(list(tags)))
+        )
+        for url_id, name in tag_rows:
+            tags[url_id].append(name)
+        for row in rows:
+            yield {
+                'id': row.id,
+                'alias': row.alias,
+                'location': row.location,
+                'views': row.views,
+                'created_at': to_timestamp(row.created_at),
+                'tags': tags[row.id],
+            }
+
+
+def iter_snippets(bind, page_size=1000):
+    snippets = Snippet.__table__
+    columns = [snippets.c.id, snippets.c.alias, snippets.c.title, snippets.c.content,
+               snippets.c.views, snippets.c.created_at]
+    for conn, rows in iter_pages(bind, snippets, columns, page_size):
+        for row in rows:
+            yield {
+                'id': row.id,
+                'alias': row.alias,
+                'title': row.title,
+                'content': row.content,
+                'views': row.views,
+                'created_at': to_timestamp(row.created_at),
+            }
+
+
+def iter_backup_json(bind, page_size=1000):
+    """Yield the backup as pieces of one {"urls": [...], "snippets": [...]} document."""
+    for key, rows in [('urls', iter_urls(bind, page_size)),
+                      ('snippets', iter_snippets(bind, page_size))]:
+        yield '{' if key == 'urls' else ','
+        yield '{}:['.format(json.dumps(key))
+        separator = ''
+        for row in rows:
+            yield separator + json.dumps(row)
+            separator = ','
+        yield ']'
+    yield '}'
+
+
+def iter_backup_ndjson(bind, page_size=1000):
+    """Yield the backup as one JSON object per line, tagged with its type."""
+    for kind, rows in [('url', iter_urls(bind, page_size)),
+                       ('snippet', iter_snippets(bind, page_size))]:
+        for row in rows:
+            row['type'] = kind
+            yield json.dumps(row) + '\n'
+
+
+def buffered(pieces, size=65536):
+    """Join small string pieces into chunks of roughly `size` bytes."""
+    chunk = []
+    length = 0
+    for piece in pieces:
+        piece = piece.encode('utf-8')
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield b''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzipped(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+DOCUMENT_KINDS = {'urls': 'url', 'snippets': 'snippet'}
+# A record can start with a list too ({"tags": [...], ...}), so only the
+# keys iter_backup_json writes mark a whole document.
+BACKUP_DOCUMENT = re.compile(r'\s*\{\s*"(?:urls|snippets)"\s*:\s*\[')
+
+
+class BackupReader(object):
+    """Incrementally reads (kind, record) pairs from a backup file.
+
+    Accepts the document written by iter_backup_json, the newline delimited
+    records of iter_backup_ndjson, a plain JSON list of records and gzip
+    compressed versions of any of them. Only the current record and a small
+    read buffer are kept in memory, and `stream` is only ever read forward.
+    With documents=False the input is always read as a list or as records.
+    """
+
+    whitespace = ' \t\r\n'
+
+    def __init__(self, stream, chunk_size=65536, documents=True):
+        self.stream = stream
+        self.documents = documents
+        self.head = stream.read(2)
+        self.inflater = None
+        if self.head == b'\x1f\x8b':
+            self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        while True:
+            data = self.head + self.stream.read(size)
+            self.head = b''
+            if self.inflater is None:
+                return data
+            if not data:
+                return self.inflater.flush()
+            data = self.inflater.decompress(data)
+            if data:
+                return data
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        data = self._read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', final=True)
+        else:
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(data)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expected {!r} at {!r}'.format(char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def _decode(self):
+        # Only objects and strings are decoded here, neither of which can
+        # parse successfully from a truncated buffer.
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, self.pos = self.json.raw_decode(self.buffer, self.pos)
+                return value
+            except ValueError:
+                if not self._fill(size):
+                    raise
+                size *= 2
+
+    def __iter__(self):
+        while len(self.buffer) < 256 and self._fill():
+            pass
+        if self.documents and BACKUP_DOCUMENT.match(self.buffer):
+            return self._iter_document()
+        if self.buffer.lstrip(self.whitespace).startswith('['):
+            return self._iter_list()
+        return self._iter_lines()
+
+    def _iter_document(self):
+        self._expect('{')
+        while self._peek() != '}':
+            kind = self._decode()
+            kind = DOCUMENT_KINDS.get(kind, kind)
+            self._expect(':')
+            self._expect('[')
+            if self._peek() == ']':
+                self.pos += 1
+            else:
+                while True:
+                    yield kind, self._decode()
+                    if self._peek() != ',':
+                        break
+                    self.pos += 1
+                self._expect(']')
+            if self._peek() == ',':
+                self.pos += 1
+        self._expect('}')
+
+    def _kind(self, record):
+        if isinstance(record, dict):
+            return record.pop('type', 'url'), record
+        return 'url', record
+
+    def _iter_list(self):
+        self._expect('[')
+        while self._peek() not in (']', ''):
+            yield self._kind(self._decode())
+            if self._peek() == ',':
+                self.pos += 1
+        self._expect(']')
+
+    def _iter_lines(self):
+        while self._peek():
+            yield self._kind(self._decode())
+
+
+def iter_restore(bind, stream, batch_size=1000):
+    """Restore a backup in batches, yielding progress after each batch.
+
+    Rows are upserted with Core bulk statements, one transaction per batch:
+    urls on (alias, location) and snippets on alias, so restoring the same
+    backup twice does not duplicate anything.
+    """
+    counts = {'urls': 0, 'snippets': 0, 'updated': 0}
+    batches = {'url': [], 'snippet': []}
+    writers = {'url': ('urls', upsert_urls), 'snippet': ('snippets', upsert_snippets)}
+
+    def flush(kind):
+        key, upsert = writers[kind]
+        with bind.begin() as conn:
+            counts['updated'] += upsert(conn, batches[kind])
+        counts[key] += len(batches[kind])
+        batches[kind] = []
+        return dict(counts)
+
+    for kind, record in BackupReader(stream):
+        if kind not in batches:
+            continue
+        record['created_at'] = from_timestamp(record.get('created_at'))
+        batches[kind].append(record)
+        if len(batches[kind]) >= batch_size:
+            yield flush(kind)
+    for kind in batches:
+        if batches[kind]:
+            yield flush(kind)
+
+
+def restore_command(argv=None):
+    parser = argparse.ArgumentParser(description='Restore a shrls backup file.')
+    parser.add_argument('path', help='backup written by /admin/backup/, optionally gzipped')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    options = parser.parse_args(argv)
+
+    counts = {'urls': 0, 'snippets': 0, 'updated': 0}
+    with open(options.path, 'rb') as stream:
+        for counts in iter_restore(engine, stream, batch_size=options.batch_size):
+            sys.stderr.write('\rRestored {urls} urls and {snippets} snippets'.format(**counts))
+    sys.stderr.write('\rRestored {urls} urls and {snippets} snippets, {updated} updated\n'.format(**counts))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from sqlalchemy import select, bindparam
+
+from shrls.models import (
+    Url,
+    Tag,
+    Snippet,
+    tags_to_urls_table,
+    alias_allocator,
+    create_short_url,
+)
+
+# Stay below SQLite's default limit of 999 bound parameters per statement
+MAX_PARAMETERS = 500
+
+
+def chunks(values, size=MAX_PARAMETERS):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def select_in(conn, columns, column, values):
+    """Rows of `columns` where `column` is one of `values`, in chunks."""
+    rows = []
+    for chunk in chunks(set(values)):
+        rows.extend(conn.execute(select(columns).where(column.in_(chunk))))
+    return rows
+
+
+def resolve_tag_ids(conn, names):
+    """Map tag names to ids, creating the missing tags."""
+    tags = Tag.__table__
+    names = set(name for name in names if name)
+    ids = dict(select_in(conn, [tags.c.name, tags.c.id], tags.c.name, names))
+    missing = names - set(ids)
+    if missing:
+        now = datetime.datetime.now()
+        conn.execute(tags.insert(), [{'name': name, 'created_at': now} for name in missing])
+        ids.update(select_in(conn, [tags.c.name, tags.c.id], tags.c.name, missing))
+    return ids
+
+
+def free_ids(conn, table, ids):
+    ids = set(i for i in ids if i is not None)
+    return ids - set(row[0] for row in select_in(conn, [table.c.id], table.c.id, ids))
+
+
+def reset_id_sequence(conn, table):
+    """Move a PostgreSQL serial id past rows inserted with explicit ids."""
+    if conn.dialect.name != 'postgresql':
+        return
+    conn.execute(
+        "SELECT setval(pg_get_serial_sequence('{0}', 'id'), coalesce(max(id), 0) + 1, false) "
+        "FROM {0}".format(table.name)
+    )
+
+
+def insert_rows(conn, table, rows, free):
+    """Insert rows, keeping their `id` only where it is not already taken."""
+    with_id = []
+    without_id = []
+    for row in rows:
+        if row.get('id') in free:
+            free.discard(row['id'])
+            with_id.append(row)
+        else:
+            without_id.append({k: v for k, v in row.items() if k != 'id'})
+    if with_id:
+        conn.execute(table.insert(), with_id)
+        reset_id_sequence(conn, table)
+    if without_id:
+        conn.execute(table.insert(), without_id)
+
+
+def upsert_urls(conn, rows):
+    """Insert or update urls, matching existing rows on (alias, location).
+
+    Several urls may share an alias, so the location is part of the key.
+    Each row is a dict of url columns plus a `tags` list of names which
+    replaces the url's tags. Returns the number of rows updated.
+    """
+    urls = Url.__table__
+    batch = {}
+    for row in rows:
+        row = dict(row)
+        row['alias'] = row.get('alias') or create_short_url()
+        batch[(row['alias'], row['location'])] = row
+    rows = list(batch.values())
+
+    def existing_ids():
+        found = {}
+        for url_id, alias, location in select_in(
+                conn, [urls.c.id, urls.c.alias, urls.c.location],
+                urls.c.alias, [row['alias'] for row in rows]):
+            if (alias, location) in batch:
+                found[(alias, location)] = max(url_id, found.get((alias, location), url_id))
+        return found
+
+    ids = existing_ids()
+    columns = ['alias', 'location', 'views', 'created_at']
+    updates = [row for row in rows if (row['alias'], row['location']) in ids]
+    inserts = [row for row in rows if (row['alias'], row['location']) not in ids]
+    if updates:
+        conn.execute(
+            urls.update()
+            .where(urls.c.id == bindparam('url_id'))
+            .values(views=bindparam('new_views'), created_at=bindparam('new_created_at')),
+            [{
+                'url_id': ids[(row['alias'], row['location'])],
+                'new_views': row.get('views'),
+                'new_created_at': row.get('created_at'),
+            } for row in updates]
+        )
+    if inserts:
+        free = free_ids(conn, urls, [row.get('id') for row in inserts])
+        insert_rows(conn, urls, [
+            dict({column: row.get(column) for column in columns}, id=row.get('id'))
+            for row in inserts
+        ], free)
+        ids = existing_ids()
+
+    tag_ids = resolve_tag_ids(conn, [name for row in rows for name in row.get('tags') or []])
+    url_ids = [ids[(row['alias'], row['location'])] for row in rows]
+    for chunk in chunks(url_ids):
+        conn.execute(tags_to_urls_table.delete().where(tags_to_urls_table.c.url_id.in_(chunk)))
+    links = [
+        {'tag_id': tag_ids[name], 'url_id': ids[(row['alias'], row['location'])]}
+        for row in rows for name in set(row.get('tags') or []) if name
+    ]
+    if links:
+        conn.execute(tags_to_urls_table.insert(), links)
+    return len(updates)
+
+
+def create_urls(conn, rows):
+    """Insert urls that do not exist yet, matching on (alias, location).
+
+    Rows are dicts with a `location` and optional `alias` and `tags`.
+    Existing (alias, location) pairs are left alone, so repeating an import
+    does not duplicate rows that name their alias. Rows without an alias
+    get a fresh one from a single batch allocation every time, so each
+    repeat creates them again. Returns (url id, created) for every row, in
+    order.
+    """
+    urls = Url.__table__
+    missing = [row for row in rows if not row.get('alias')]
+    for row, alias in zip(missing, alias_allocator.allocate_many(len(missing))):
+        row['alias'] = alias
+    keys = [(row['alias'], row['location']) for row in rows]
+
+    def existing_ids():
+        found = {}
+        for url_id, alias, location in select_in(
+                conn, [urls.c.id, urls.c.alias, urls.c.location],
+                urls.c.alias, [alias for alias, _ in keys]):
+            if (alias, location) in batch:
+                found[(alias, location)] = max(url_id, found.get((alias, location), url_id))
+        return found
+
+    batch = dict(zip(keys, rows))
+    ids = existing_ids()
+    created = []
+    seen = set(ids)
+    for key in keys:
+        created.append(key not in seen)
+        seen.add(key)
+    new = [row for row, is_new in zip(rows, created) if is_new]
+    if new:
+        now = datetime.datetime.now()
+        conn.execute(urls.insert(), [{
+            'alias': row['alias'],
+            'location': row['location'],
+            'views': 0,
+            'created_at': now,
+        } for row in new])
+        ids = existing_ids()
+        tag_ids = resolve_tag_ids(conn, [name for row in new for name in row.get('tags') or []])
+        links = [
+            {'tag_id': tag_ids[name], 'url_id': ids[(row['alias'], row['location'])]}
+            for row in new for name in set(row.get('tags') or []) if name
+        ]
+        if links:
+            conn.execute(tags_to_urls_table.insert(), links)
+    return [(ids[key], is_new) for key, is_new in zip(keys, created)]
+
+
+def upsert_snippets(conn, rows):
+    """Insert or update snippets, matching existing rows on alias.
+
+    Returns the number of rows updated.
+    """
+    snippets = Snippet.__table__
+    batch = {}
+    for row in rows:
+        row = dict(row)
+        row['alias'] = row.get('alias') or create_short_url()
+        batch[row['alias']] = row
+    rows = list(batch.values())
+
+    ids = dict(select_in(conn, [snippets.c.alias, snippets.c.id], snippets.c.alias, batch))
+    columns = ['alias', 'title', 'content', 'views', 'created_at']
+    updates = [row for row in rows if row['alias'] in ids]
+    inserts = [row for row in rows if row['alias'] not in ids]
+    if updates:
+        conn.execute(
+            snippets.update()
+            .where(snippets.c.id == bindparam('snippet_id'))
+            .values(
+                title=bindparam('new_title'),
+                content=bindparam('new_content'),
+                views=bindparam('new_views'),
+                created_at=bindparam('new_created_at'),
+            ),
+            [{
+                'snippet_id': ids[row['alias']],
+                'new_title': row.get('title'),
+                'new_content': row.get('content'),
+                'new_views': row.get('views'),
+                'new_created_at': row.get('created_at'),
+            } for row in updates]
+        )
+    if inserts:
+        free = free_ids(conn, snippets, [row.get('id') for row in inserts])
+        insert_rows(conn, snippets, [
+            dict({column: row.get(column) for column in columns}, id=row.get('id'))
+            for row in inserts
+        ], free)
+    return len(updates)
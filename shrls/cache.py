@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import OrderedDict
+
+from shrls import app
+
+
+class LRUCache(object):
+    """Thread safe least recently used cache with an optional time to live.
+
+    Entries older than `ttl` seconds are treated as missing. Once more than
+    `maxsize` entries are stored the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None
+        if self.ttl:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Alias -> tuple of (url id, location) redirect candidates
+alias_cache = LRUCache(
+    maxsize=app.config['shrls_alias_cache_size'],
+    ttl=app.config['shrls_alias_cache_ttl'],
+)
+
+# Location -> (url ids, final location) of redirect chains without random hops
+chain_cache = LRUCache(
+    maxsize=app.config['shrls_alias_cache_size'],
+    ttl=app.config['shrls_alias_cache_ttl'],
+)
+
+# Tag name -> tuple of the aliases of its urls
+tag_cache = LRUCache(
+    maxsize=app.config['shrls_alias_cache_size'],
+    ttl=app.config['shrls_alias_cache_ttl'],
+)
+
+# (alias, format) -> (snippet id, rendered body, content type, etag)
+snippet_cache = LRUCache(
+    maxsize=app.config['shrls_snippet_cache_size'],
+    ttl=app.config['shrls_alias_cache_ttl'],
+)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import threading
+from collections import Counter
+
+from sqlalchemy import bindparam, func
+
+from shrls import app
+from shrls.models import engine, Url, Snippet
+
+
+class ShardedCounter(object):
+    """Counter split over independently locked shards.
+
+    Threads adding to different keys rarely wait on the same lock, and
+    drain() empties the shards one at a time. Each shard keeps its Counter
+    for good, so an add() never lands in a Counter that was drained.
+    """
+
+    def __init__(self, shards=16):
+        self._shards = [(threading.Lock(), Counter()) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def add(self, key, delta=1):
+        lock, counts = self._shard(key)
+        with lock:
+            counts[key] += delta
+
+    def get(self, key):
+        lock, counts = self._shard(key)
+        with lock:
+            return counts.get(key, 0)
+
+    def update(self, other):
+        for key, delta in other.items():
+            self.add(key, delta)
+
+    def drain(self):
+        """Remove and return every count."""
+        drained = Counter()
+        for lock, counts in self._shards:
+            with lock:
+                drained.update(counts)
+                counts.clear()
+        return drained
+
+
+class ViewCounters(object):
+    """In memory `views` increments for urls and snippets.
+
+    Hits are only counted in memory. Every `flush_interval` seconds a
+    background thread writes them with one `UPDATE ... SET views = views
+    + :delta` per table, so serving a redirect never takes a write lock.
+    pending() is what a row has gained since its `views` was last written.
+    """
+
+    def __init__(self, bind, shards=16, flush_interval=1.0, asynchronous=True):
+        self.bind = bind
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self.counts = ShardedCounter(shards)
+        self.failed = 0
+        self._flushing = Counter()
+        self._flush_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def hit(self, table, *row_ids):
+        for row_id in row_ids:
+            self.counts.add((table, row_id))
+        if not row_ids:
+            return
+        if self.asynchronous:
+            self.start()
+        else:
+            self.flush()
+
+    def hit_url(self, *urls_ids):
+        self.hit(Url.__table__, *urls_ids)
+
+    def hit_snippet(self, *snippet_ids):
+        self.hit(Snippet.__table__, *snippet_ids)
+
+    def pending(self, table, row_id):
+        key = (table, row_id)
+        with self._pending_lock:
+            return self.counts.get(key) + self._flushing.get(key, 0)
+
+    def with_pending(self, table, row_id, views):
+        return (views or 0) + self.pending(table, row_id)
+
+    def flush(self):
+        """Write every pending increment."""
+        with self._flush_lock:
+            # pending() sees a batch in exactly one of counts and _flushing
+            with self._pending_lock:
+                self._flushing = self.counts.drain()
+            try:
+                if self._flushing:
+                    self.write(self._flushing)
+            except Exception:
+                with self._pending_lock:
+                    self.counts.update(self._flushing)
+                    self._flushing = Counter()
+                raise
+            with self._pending_lock:
+                self._flushing = Counter()
+
+    def write(self, counts):
+        with self.bind.begin() as conn:
+            for table in set(table for table, _ in counts):
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == bindparam('row_id'))
+                    .values(views=func.coalesce(table.c.views, 0) + bindparam('delta')),
+                    [{'row_id': row_id, 'delta': delta}
+                     for (t, row_id), delta in counts.items() if t is table]
+                )
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='shrls-view-counters')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flushing thread after a last flush."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            stopping = self._stopping.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Unable to write view counts')
+                with self._lock:
+                    self.failed += 1
+
+
+view_counters = ViewCounters(
+    engine,
+    shards=app.config['shrls_view_counter_shards'],
+    flush_interval=app.config['shrls_view_counter_flush_interval'],
+    asynchronous=app.config['shrls_click_recorder_async'],
+)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+
+from sqlalchemy import select, exc
+
+from shrls import app
+from shrls.models import (
+    engine,
+    HeaderName,
+    intern_header_names,
+)
+
+
+class HeaderCodec(object):
+    """Packs request headers into the compact `View.header_data` format.
+
+    Only headers named in `allowlist` (case insensitive, None keeps all of
+    them) are stored. Header names are interned in the header_names table
+    and the values are stored as one JSON object keyed by name id.
+    """
+
+    def __init__(self, bind, allowlist=None):
+        self.bind = bind
+        self.allowlist = None
+        if allowlist is not None:
+            self.allowlist = set(name.lower() for name in allowlist)
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def encode(self, headers):
+        headers = [(k, v) for k, v in headers
+                   if self.allowlist is None or k.lower() in self.allowlist]
+        if not headers:
+            return None
+        self._intern(set(k for k, _ in headers))
+        return json.dumps(
+            {str(self._ids[k]): v for k, v in headers},
+            separators=(',', ':'),
+        )
+
+    def decode(self, header_data):
+        if not header_data:
+            return {}
+        data = json.loads(header_data)
+        if any(int(name_id) not in self._names for name_id in data):
+            self._load()
+        return {self._names.get(int(name_id), name_id): v for name_id, v in data.items()}
+
+    def _intern(self, names):
+        with self._lock:
+            if not names - set(self._ids):
+                return
+            known = dict(self._ids)
+            try:
+                with self.bind.begin() as conn:
+                    intern_header_names(conn, names, known)
+            except exc.IntegrityError:
+                # Another process interned the same name first
+                with self.bind.begin() as conn:
+                    intern_header_names(conn, names, known)
+            self._ids = known
+            self._names = {v: k for k, v in known.items()}
+
+    def _load(self):
+        table = HeaderName.__table__
+        with self.bind.connect() as conn:
+            known = dict(conn.execute(select([table.c.name, table.c.id])).fetchall())
+        with self._lock:
+            self._ids = known
+            self._names = {v: k for k, v in known.items()}
+
+
+header_codec = HeaderCodec(engine, app.config['shrls_recorded_headers'])
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def buffer_logging(logger):
+    """Move the handlers of `logger` behind a queue drained by a thread.
+
+    Requests only pay for putting the record on the queue, the writes to
+    stderr or files happen on the listener thread. Returns the listener.
+    """
+    handlers = list(logger.handlers)
+    if not handlers:
+        return None
+    for handler in handlers:
+        logger.removeHandler(handler)
+    records = queue.Queue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import bisect
+import threading
+from collections import defaultdict
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shrls import app
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+STATEMENT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(name, format_labels(dict(labels, le=bound)), cumulative)
+        yield '{}_sum{} {}'.format(name, format_labels(labels), self.sum)
+        yield '{}_count{} {}'.format(name, format_labels(labels), self.count)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    ) for key, value in sorted(labels.items())) + '}'
+
+
+class RequestTrace(object):
+    """SQL executed while serving the current request."""
+
+    def __init__(self, keep_statements):
+        self.start = time.time()
+        self.status = None
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.commits = 0
+        self.executed = [] if keep_statements else None
+
+
+class Metrics(object):
+    """Per endpoint request and SQL metrics in the Prometheus text format.
+
+    Flask request hooks open a trace per request in a thread local, and
+    SQLAlchemy engine events add every statement and commit run by that
+    thread to it. Work done by background threads is only counted in the
+    process wide statement and commit totals.
+    """
+
+    def __init__(self, slow_request_seconds=None, max_logged_statements=100):
+        self.slow_request_seconds = slow_request_seconds
+        self.max_logged_statements = max_logged_statements
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.request_statements = {}
+        self.sql_seconds = defaultdict(float)
+        self.statements = 0
+        self.commits = defaultdict(int)
+        self.gauges = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def register_gauge(self, name, help_text, value):
+        """Report the result of calling `value` on every scrape."""
+        self.gauges.append((name, help_text, value))
+
+    @property
+    def trace(self):
+        return getattr(self._local, 'trace', None)
+
+    def start_request(self):
+        self._local.trace = RequestTrace(self.slow_request_seconds is not None)
+
+    def finish_request(self, endpoint):
+        trace = self.trace
+        if trace is None:
+            return
+        self._local.trace = None
+        duration = time.time() - trace.start
+        with self._lock:
+            self.requests[(endpoint, request.method, trace.status)] += 1
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.request_statements.setdefault(endpoint, Histogram(STATEMENT_BUCKETS)).observe(trace.statements)
+            self.sql_seconds[endpoint] += trace.sql_seconds
+            self.commits[endpoint] += trace.commits
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            app.logger.warning(
+                'Slow request %s %s (%s) took %.3fs with %d statements in %.3fs:\n%s',
+                request.method, request.path, endpoint, duration, trace.statements, trace.sql_seconds,
+                '\n'.join('  {:.4f}s {}'.format(seconds, ' '.join(statement.split()))
+                          for statement, seconds in trace.executed),
+            )
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('shrls_query_start', []).append(time.time())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('shrls_query_start')
+        seconds = time.time() - starts.pop() if starts else 0.0
+        with self._lock:
+            self.statements += 1
+        trace = self.trace
+        if trace is not None:
+            trace.statements += 1
+            trace.sql_seconds += seconds
+            if trace.executed is not None and len(trace.executed) < self.max_logged_statements:
+                trace.executed.append((statement, seconds))
+
+    def on_commit(self, conn):
+        trace = self.trace
+        if trace is not None:
+            trace.commits += 1
+        else:
+            with self._lock:
+                self.commits[None] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP shrls_requests_total Requests served by endpoint, method and status.')
+            lines.append('# TYPE shrls_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items(), key=str):
+                lines.append('shrls_requests_total{} {}'.format(
+                    format_labels({'endpoint': endpoint, 'method': method, 'status': status}), count))
+            lines.append('# HELP shrls_request_seconds Request latency by endpoint.')
+            lines.append('# TYPE shrls_request_seconds histogram')
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines('shrls_request_seconds', {'endpoint': endpoint}))
+            lines.append('# HELP shrls_request_sql_statements SQL statements run per request by endpoint.')
+            lines.append('# TYPE shrls_request_sql_statements histogram')
+            for endpoint, histogram in sorted(self.request_statements.items()):
+                lines.extend(histogram.lines('shrls_request_sql_statements', {'endpoint': endpoint}))
+            lines.append('# HELP shrls_request_sql_seconds_total Time spent in SQL by endpoint.')
+            lines.append('# TYPE shrls_request_sql_seconds_total counter')
+            for endpoint, seconds in sorted(self.sql_seconds.items()):
+                lines.append('shrls_request_sql_seconds_total{} {}'.format(
+                    format_labels({'endpoint': endpoint}), seconds))
+            lines.append('# HELP shrls_sql_statements_total SQL statements run by the process.')
+            lines.append('# TYPE shrls_sql_statements_total counter')
+            lines.append('shrls_sql_statements_total {}'.format(self.statements))
+            lines.append('# HELP shrls_db_commits_total Database commits by endpoint, background for work outside requests.')
+            lines.append('# TYPE shrls_db_commits_total counter')
+            for endpoint, count in sorted(self.commits.items(), key=str):
+                lines.append('shrls_db_commits_total{} {}'.format(
+                    format_labels({'endpoint': endpoint or 'background'}), count))
+        for name, help_text, value in self.gauges:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} gauge'.format(name))
+            lines.append('{} {}'.format(name, value()))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(slow_request_seconds=app.config['shrls_slow_request_seconds'])
+
+event.listen(Engine, 'before_cursor_execute', metrics.before_execute)
+event.listen(Engine, 'after_cursor_execute', metrics.after_execute)
+event.listen(Engine, 'commit', metrics.on_commit)
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+
+@app.after_request
+def note_response_status(response):
+    trace = metrics.trace
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    if exception is not None and metrics.trace is not None:
+        metrics.trace.status = 500
+    metrics.finish_request(endpoint)
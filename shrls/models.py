@@ -1,23 +1,84 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
 import string
-import random
 import datetime
 
 from shrls import app
+from shrls.aliases import AliasAllocator
 
-from sqlalchemy import create_engine
-from sqlalchemy import Table, Column, Integer, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, inspect, select, func, event, bindparam, exc, DDL
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import Table, MetaData, Index, Column, Integer, Text, DateTime, ForeignKey
 from sqlalchemy.orm import scoped_session, sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 allowed_shortner_chars = string.ascii_letters + string.digits
 
-engine = create_engine(
-    app.config['SQLALCHEMY_DATABASE_URI'],
-    convert_unicode=True
-)
+
+def sqlite_pragmas(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+    return set_pragmas
+
+
+def postgresql_read_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+    cursor.close()
+    dbapi_connection.commit()
+
+
+def make_engine(uri, pragmas=None, pool_size=None, max_overflow=None, pool_timeout=None, read_only=False,
+                options=None):
+    """Create an engine with the shrls connection profile.
+
+    SQLite connections get `pragmas` (name, value) pairs run on connect,
+    plus query_only when `read_only` is set. Databases other than in
+    memory SQLite get a QueuePool shared between threads, and networked
+    servers have their connections pinged before use. `options` are
+    passed on to create_engine as is.
+    """
+    url = make_url(uri)
+    engine_options = {'convert_unicode': True}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            pool_size = None
+        else:
+            engine_options['connect_args'] = {'check_same_thread': False}
+            engine_options['poolclass'] = QueuePool
+    else:
+        engine_options['pool_pre_ping'] = True
+    if pool_size is not None:
+        engine_options['pool_size'] = pool_size
+        engine_options['max_overflow'] = max_overflow
+        engine_options['pool_timeout'] = pool_timeout
+    engine_options.update(options or {})
+    new_engine = create_engine(url, **engine_options)
+    if new_engine.dialect.name == 'sqlite':
+        pragmas = list((pragmas or {}).items())
+        if read_only:
+            pragmas.append(('query_only', 1))
+        if pragmas:
+            event.listen(new_engine, 'connect', sqlite_pragmas(pragmas))
+    elif new_engine.dialect.name == 'postgresql' and read_only:
+        event.listen(new_engine, 'connect', postgresql_read_only)
+    return new_engine
+
+
+engine_profile = {
+    'pragmas': app.config['shrls_sqlite_pragmas'],
+    'pool_size': app.config['shrls_pool_size'],
+    'max_overflow': app.config['shrls_pool_max_overflow'],
+    'pool_timeout': app.config['shrls_pool_timeout'],
+    'options': app.config['shrls_engine_options'],
+}
+engine = make_engine(app.config['SQLALCHEMY_DATABASE_URI'], **engine_profile)
 
 DBSession = scoped_session(
     sessionmaker(
@@ -27,28 +88,37 @@ DBSession = scoped_session(
     )
 )
 
+# Redirect lookups read through their own pool of read only connections so
+# they never queue behind writers for a connection, optionally to a replica.
+read_engine = engine
+if app.config['shrls_read_only_pool'] or app.config['shrls_read_database_uri']:
+    read_engine = make_engine(
+        app.config['shrls_read_database_uri'] or app.config['SQLALCHEMY_DATABASE_URI'],
+        read_only=True,
+        **engine_profile
+    )
+
+ReadSession = scoped_session(
+    sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=read_engine
+    )
+)
+
 Base = declarative_base()
 Base.query = DBSession.query_property()
 
 
 def create_short_url():
-    alias = None
-    entries = []
-    while not(alias):
-        alias = ''.join(
-            [random.choice(allowed_shortner_chars) for _ in range(5)]
-        )
-        entries = DBSession.query(Url).filter(Url.alias == alias).first()
-        if entries:
-            alias = None
-    return alias
+    return alias_allocator.allocate()
 
 
 # Tags to Urls Association Table
 tags_to_urls_table = Table(
     'tags_to_urls', Base.metadata,
-    Column('tag_id', Integer, ForeignKey('tags.id')),
-    Column('url_id', Integer, ForeignKey('urls.id')),
+    Column('tag_id', Integer, ForeignKey('tags.id'), index=True),
+    Column('url_id', Integer, ForeignKey('urls.id'), index=True),
 )
 
 
@@ -56,7 +126,7 @@ class Tag(Base):
     __tablename__ = 'tags'
     id = Column(Integer, primary_key=True)
     created_at = Column(DateTime)
-    name = Column(Text)
+    name = Column(Text, index=True, unique=True)
     urls = relationship("Url", secondary=tags_to_urls_table, back_populates="tags")
 
     def __init__(self, name):
@@ -70,8 +140,8 @@ class Tag(Base):
 class Url(Base):
     __tablename__ = 'urls'
     id = Column(Integer, primary_key=True)
-    created_at = Column(DateTime)
-    alias = Column(Text)
+    created_at = Column(DateTime, index=True)
+    alias = Column(Text, index=True)
     location = Column(Text)
     views = Column(Integer)
     tags = relationship("Tag", secondary=tags_to_urls_table, back_populates="urls")
@@ -111,35 +181,316 @@ class Snippet(Base):
         return str(self.alias)
 
 
+class Upload(Base):
+    """An uploaded file name and the digest of its blob in the upload store."""
+    __tablename__ = 'uploads'
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime)
+    name = Column(Text, index=True, unique=True)
+    digest = Column(Text)
+    size = Column(Integer)
+
+    def __init__(self, name, digest, size):
+        self.name = name
+        self.digest = digest
+        self.size = size
+        self.created_at = datetime.datetime.now()
+
+    def __repr__(self):
+        return str(self.name)
+
+
 class View(Base):
     __tablename__ = 'views'
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime)
-    urls_id = Column(Integer, ForeignKey('urls.id'))
+    timestamp = Column(DateTime, index=True)
+    urls_id = Column(Integer, ForeignKey('urls.id'), index=True)
     ip = Column(Text)
     request = Column(Text)
-    headers = relationship("Header", back_populates='view')
+    # JSON object of recorded header values keyed by HeaderName id
+    header_data = Column(Text)
     url = relationship("Url", back_populates='requests')
 
-    def __init__(self, urls_id, ip, request):
+    def __init__(self, urls_id, ip, request, header_data=None):
         self.timestamp = datetime.datetime.now()
         self.urls_id = urls_id
         self.ip = ip
         self.request = request
+        self.header_data = header_data
 
 
-class Header(Base):
-    __tablename__ = 'headers'
+class HeaderName(Base):
+    __tablename__ = 'header_names'
     id = Column(Integer, primary_key=True)
-    views_id = Column(Integer, ForeignKey('views.id'))
-    key = Column(Text)
+    name = Column(Text, index=True, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return str(self.name)
+
+
+def intern_header_names(conn, names, known):
+    """Add the ids of `names` to the `known` name -> id dict, creating them."""
+    table = HeaderName.__table__
+    missing = set(names) - set(known)
+    if missing:
+        known.update(conn.execute(
+            select([table.c.name, table.c.id]).where(table.c.name.in_(missing))
+        ).fetchall())
+        missing -= set(known)
+    if missing:
+        conn.execute(table.insert(), [{'name': name} for name in missing])
+        known.update(conn.execute(
+            select([table.c.name, table.c.id]).where(table.c.name.in_(missing))
+        ).fetchall())
+    return known
+
+
+class ClickRollup(Base):
+    """Number of clicks on a url per hour or day.
+
+    `dimension` is 'total' (with an empty `value`), 'referrer' (the
+    referring host) or 'agent' (the user agent family).
+    """
+    __tablename__ = 'click_rollups'
+    __table_args__ = (
+        Index('ix_click_rollups_key', 'urls_id', 'granularity', 'dimension', 'period', 'value', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    urls_id = Column(Integer, ForeignKey('urls.id'))
+    granularity = Column(Text)
+    dimension = Column(Text)
+    period = Column(DateTime)
     value = Column(Text)
-    view = relationship("View", back_populates='headers')
+    clicks = Column(Integer)
+
+
+# Clicks used to store one row per request header here. It only exists in
+# databases created before header_data and is emptied by migrate_shrls_db.
+legacy_headers_table = Table(
+    'headers', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('views_id', Integer),
+    Column('key', Text),
+    Column('value', Text),
+)
+
+
+# Trigram full text index over urls used by the admin search, kept in sync
+# with urls and tags_to_urls by triggers. Tag names are newline separated.
+url_tag_names = (
+    "(SELECT group_concat(tags.name, char(10)) FROM tags "
+    "JOIN tags_to_urls ON tags.id = tags_to_urls.tag_id "
+    "WHERE tags_to_urls.url_id = {})"
+)
+search_index_ddl = [
+    DDL("CREATE VIRTUAL TABLE IF NOT EXISTS urls_search "
+        "USING fts5(alias, location, tags, tokenize='trigram')"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_insert AFTER INSERT ON urls BEGIN "
+        "INSERT INTO urls_search (rowid, alias, location, tags) "
+        "VALUES (new.id, new.alias, new.location, " + url_tag_names.format('new.id') + "); END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_update AFTER UPDATE OF alias, location ON urls BEGIN "
+        "UPDATE urls_search SET alias = new.alias, location = new.location "
+        "WHERE rowid = new.id; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_delete AFTER DELETE ON urls BEGIN "
+        "DELETE FROM urls_search WHERE rowid = old.id; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_tag_insert AFTER INSERT ON tags_to_urls BEGIN "
+        "UPDATE urls_search SET tags = " + url_tag_names.format('new.url_id') + " "
+        "WHERE rowid = new.url_id; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_tag_update AFTER UPDATE ON tags_to_urls BEGIN "
+        "UPDATE urls_search SET tags = " + url_tag_names.format('new.url_id') + " "
+        "WHERE rowid = new.url_id; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS urls_search_tag_delete AFTER DELETE ON tags_to_urls BEGIN "
+        "UPDATE urls_search SET tags = " + url_tag_names.format('old.url_id') + " "
+        "WHERE rowid = old.url_id; END"),
+]
+
 
-    def __init__(self, key, value):
-        self.key = key
-        self.value = value
+def search_index_available(conn):
+    """Whether this SQLite has FTS5 with the trigram tokenizer (3.34+)."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.shrls_fts5_probe USING fts5(x, tokenize='trigram')")
+    except exc.OperationalError:
+        return False
+    conn.execute('DROP TABLE temp.shrls_fts5_probe')
+    return True
+
+
+def use_search_index(conn):
+    if app.config['shrls_search_index'] != 'fts5' or conn.dialect.name != 'sqlite':
+        return False
+    if not search_index_available(conn):
+        app.logger.warning('SQLite %s has no FTS5 trigram tokenizer, searches will use LIKE',
+                           conn.execute('SELECT sqlite_version()').scalar())
+        return False
+    return True
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def create_search_index_tables(target, connection, **kwargs):
+    if use_search_index(connection):
+        for ddl in search_index_ddl:
+            connection.execute(ddl)
+
+
+class AliasSequence(Base):
+    __tablename__ = 'alias_sequence'
+    id = Column(Integer, primary_key=True)
+    next_value = Column(Integer)
+    # Hex key of the permutation from counter values to aliases
+    secret = Column(Text)
+
+
+alias_allocator = AliasAllocator(
+    engine,
+    AliasSequence.__table__,
+    [Url.__table__.c.alias, Snippet.__table__.c.alias],
+    allowed_shortner_chars,
+    min_length=app.config['shrls_alias_min_length'],
+    block_size=app.config['shrls_alias_block_size'],
+    density=app.config['shrls_alias_density'],
+)
 
 
 def initialize_shrls_db():
     Base.metadata.create_all(bind=engine)
+
+
+def merge_duplicate_tags(conn):
+    tags = Tag.__table__
+    duplicates = conn.execute(
+        select([tags.c.name, func.min(tags.c.id)])
+        .group_by(tags.c.name)
+        .having(func.count() > 1)
+    ).fetchall()
+    for name, keep_id in duplicates:
+        duplicate_ids = [row[0] for row in conn.execute(
+            select([tags.c.id]).where(tags.c.name == name).where(tags.c.id != keep_id)
+        )]
+        conn.execute(
+            tags_to_urls_table.update()
+            .where(tags_to_urls_table.c.tag_id.in_(duplicate_ids))
+            .values(tag_id=keep_id)
+        )
+        conn.execute(tags.delete().where(tags.c.id.in_(duplicate_ids)))
+
+    links = tags_to_urls_table
+    duplicates = conn.execute(
+        select([links.c.tag_id, links.c.url_id])
+        .group_by(links.c.tag_id, links.c.url_id)
+        .having(func.count() > 1)
+    ).fetchall()
+    for tag_id, url_id in duplicates:
+        conn.execute(links.delete().where(links.c.tag_id == tag_id).where(links.c.url_id == url_id))
+        conn.execute(links.insert().values(tag_id=tag_id, url_id=url_id))
+
+
+def add_missing_columns(conn):
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(dialect=conn.dialect)
+                ))
+
+
+def create_missing_indexes(conn):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=conn)
+
+
+def create_search_index(conn):
+    if not use_search_index(conn):
+        return
+    for ddl in search_index_ddl:
+        conn.execute(ddl)
+    indexed = conn.execute('SELECT count(*) FROM urls_search').scalar()
+    if indexed != conn.execute('SELECT count(*) FROM urls').scalar():
+        conn.execute('DELETE FROM urls_search')
+        conn.execute(
+            'INSERT INTO urls_search (rowid, alias, location, tags) '
+            'SELECT urls.id, urls.alias, urls.location, ' + url_tag_names.format('urls.id') + ' '
+            'FROM urls'
+        )
+
+
+def migrate_header_rows(conn, batch_size=10000):
+    """Pack legacy per header rows into views.header_data, then drop them.
+
+    Every legacy header is kept unless shrls_migrate_recorded_headers_only
+    is set, then only the shrls_recorded_headers are, like for new clicks.
+    The headers table is dropped afterwards, so the others are lost.
+    """
+    if legacy_headers_table.name not in inspect(conn).get_table_names():
+        return
+    allowlist = None
+    if app.config['shrls_migrate_recorded_headers_only']:
+        allowlist = app.config['shrls_recorded_headers']
+    if allowlist is not None:
+        allowlist = set(name.lower() for name in allowlist)
+    headers = legacy_headers_table
+    views = View.__table__
+    known = {}
+    last_id = 0
+    while True:
+        view_ids = [row[0] for row in conn.execute(
+            select([headers.c.views_id]).distinct()
+            .where(headers.c.views_id > last_id)
+            .order_by(headers.c.views_id)
+            .limit(batch_size)
+        )]
+        if not view_ids:
+            break
+        rows = conn.execute(
+            select([headers.c.views_id, headers.c.key, headers.c.value])
+            .where(headers.c.views_id.between(view_ids[0], view_ids[-1]))
+            .order_by(headers.c.id)
+        ).fetchall()
+        if allowlist is not None:
+            rows = [row for row in rows if row.key and row.key.lower() in allowlist]
+        intern_header_names(conn, set(row.key for row in rows), known)
+        packed = {}
+        for views_id, key, value in rows:
+            packed.setdefault(views_id, {})[str(known[key])] = value
+        if packed:
+            conn.execute(
+                views.update()
+                .where(views.c.id == bindparam('view_id'))
+                .values(header_data=bindparam('new_header_data')),
+                [{'view_id': views_id, 'new_header_data': json.dumps(data, separators=(',', ':'))}
+                 for views_id, data in packed.items()]
+            )
+        last_id = view_ids[-1]
+    headers.drop(bind=conn)
+
+
+migrations = [
+    merge_duplicate_tags,
+    add_missing_columns,
+    create_missing_indexes,
+    create_search_index,
+    migrate_header_rows,
+]
+
+
+def migrate_shrls_db():
+    """Upgrade an existing database in place.
+
+    Every migration is idempotent so this is safe to run on databases of
+    any age, including ones created by the current initialize_shrls_db.
+    """
+    Base.metadata.create_all(bind=engine)
+    for migration in migrations:
+        with engine.begin() as conn:
+            migration(conn)
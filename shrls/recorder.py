@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import atexit
+import datetime
+import threading
+from collections import Counter, namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from sqlalchemy import exc, select
+
+from shrls import app
+from shrls.counters import view_counters
+from shrls.headers import header_codec
+from shrls.stats import apply_rollups, rollup_keys
+from shrls.models import (
+    engine,
+    Url,
+    View,
+)
+
+Click = namedtuple('Click', ['timestamp', 'urls_id', 'ip', 'request', 'headers'])
+
+_stop = object()
+
+
+class ClickRecorder(object):
+    """Records redirect clicks from a background thread.
+
+    Clicks are put on a bounded queue and written by a single worker in
+    batches of up to `batch_size`, or whatever has arrived after
+    `flush_interval` seconds. Each batch is one transaction which inserts
+    the views with their packed headers and, when `rollups` is set, adds
+    the clicks to the click_rollups table. `Url.views` is counted right away
+    by view_counters. Anything arriving while the queue is full is counted
+    in `dropped`, clicks that could not be written, including those for urls
+    deleted after they were queued, in `failed`.
+    """
+
+    def __init__(self, bind, maxsize=10000, batch_size=500, flush_interval=1.0, asynchronous=True,
+                 rollups=True):
+        self.bind = bind
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, urls_id, ip, request, headers):
+        view_counters.hit_url(urls_id)
+        self.put([Click(datetime.datetime.now(), urls_id, ip, request, headers)])
+
+    def put(self, items):
+        if not items:
+            return
+        if not self.asynchronous:
+            self.write(items)
+            return
+        self.start()
+        for item in items:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='shrls-click-recorder')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def flush(self):
+        """Block until every queued click has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.join()
+
+    def stop(self):
+        """Drain the queue and stop the worker thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.queue.put(_stop)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                try:
+                    click = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if click is _stop:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                batch.append(click)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception:
+                    app.logger.exception('Unable to record %d clicks', len(batch))
+                    with self._lock:
+                        self.failed += len(batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+
+    def write(self, batch):
+        for attempt in range(3):
+            try:
+                self._insert(batch)
+                return
+            except exc.IntegrityError:
+                # Another process created one of the same rollup rows first,
+                # or a url was deleted after its clicks were queued
+                if attempt == 2:
+                    raise
+                live = self._live_clicks(batch)
+                if len(live) < len(batch):
+                    app.logger.warning('Dropping %d clicks for deleted urls', len(batch) - len(live))
+                    with self._lock:
+                        self.failed += len(batch) - len(live)
+                    batch = live
+                if not batch:
+                    return
+
+    def _live_clicks(self, batch):
+        urls = Url.__table__
+        with self.bind.connect() as conn:
+            live = set(row[0] for row in conn.execute(
+                select([urls.c.id]).where(urls.c.id.in_(set(item.urls_id for item in batch)))
+            ))
+        return [item for item in batch if item.urls_id in live]
+
+    def _insert(self, batch):
+        views = View.__table__
+        view_rows = []
+        rollups = Counter()
+        for item in batch:
+            view_rows.append({
+                'timestamp': item.timestamp,
+                'urls_id': item.urls_id,
+                'ip': item.ip,
+                'request': item.request,
+                'header_data': header_codec.encode(item.headers),
+            })
+            if self.rollups:
+                rollups.update(rollup_keys(item.urls_id, item.timestamp, item.headers))
+        with self.bind.begin() as conn:
+            conn.execute(views.insert(), view_rows)
+            if rollups:
+                apply_rollups(conn, rollups)
+
+click_recorder = ClickRecorder(
+    engine,
+    maxsize=app.config['shrls_click_queue_size'],
+    batch_size=app.config['shrls_click_batch_size'],
+    flush_interval=app.config['shrls_click_flush_interval'],
+    asynchronous=app.config['shrls_click_recorder_async'],
+    rollups=app.config['shrls_click_rollups'],
+)
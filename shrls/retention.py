@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import argparse
+import datetime
+import tempfile
+
+from sqlalchemy import select, and_, or_
+
+from shrls import app
+from shrls.backup import to_timestamp, from_timestamp
+from shrls.bulk import chunks, free_ids
+from shrls.headers import header_codec
+from shrls.models import (
+    engine,
+    Url,
+    View,
+)
+
+SEGMENT_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+# views-<first timestamp>-<last timestamp>-<last id>.ndjson.gz
+SEGMENT_NAME = re.compile(r'^views-(\d{20})-(\d{20})-(\d+)\.ndjson\.gz$')
+
+
+def segment_name(first, last):
+    return 'views-{}-{}-{}.ndjson.gz'.format(
+        first.timestamp.strftime(SEGMENT_TIME_FORMAT),
+        last.timestamp.strftime(SEGMENT_TIME_FORMAT),
+        last.id,
+    )
+
+
+def list_segments(folder):
+    """(first timestamp, last timestamp, last id, path) of every segment, in order."""
+    if not os.path.isdir(folder):
+        return []
+    segments = []
+    for name in os.listdir(folder):
+        match = SEGMENT_NAME.match(name)
+        if match:
+            segments.append((
+                datetime.datetime.strptime(match.group(1), SEGMENT_TIME_FORMAT),
+                datetime.datetime.strptime(match.group(2), SEGMENT_TIME_FORMAT),
+                int(match.group(3)),
+                os.path.join(folder, name),
+            ))
+    return sorted(segments)
+
+
+def archived_through(folder):
+    """The (timestamp, id) of the newest archived view, or None."""
+    segments = list_segments(folder)
+    if not segments:
+        return None
+    return max((last, last_id) for _, last, last_id, _ in segments)
+
+
+def key_after(views, key):
+    timestamp, view_id = key
+    return or_(views.c.timestamp > timestamp, and_(views.c.timestamp == timestamp, views.c.id > view_id))
+
+
+def key_through(views, key):
+    timestamp, view_id = key
+    return or_(views.c.timestamp < timestamp, and_(views.c.timestamp == timestamp, views.c.id <= view_id))
+
+
+def write_segment(folder, rows):
+    """Write rows to a new gzipped NDJSON segment, appearing atomically."""
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_path = tempfile.mkstemp(prefix='.segment-', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as segment:
+                for row in rows:
+                    segment.write((json.dumps({
+                        'id': row.id,
+                        'timestamp': to_timestamp(row.timestamp),
+                        'urls_id': row.urls_id,
+                        'alias': row.alias,
+                        'ip': row.ip,
+                        'request': row.request,
+                        'headers': header_codec.decode(row.header_data),
+                    }) + '\n').encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        path = os.path.join(folder, segment_name(rows[0], rows[-1]))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def delete_archived(bind, key, batch_size=500, pause=0.0):
+    """Delete views up to `key` in small transactions. Returns the count."""
+    views = View.__table__
+    deleted = 0
+    while True:
+        with bind.begin() as conn:
+            ids = [row[0] for row in conn.execute(
+                select([views.c.id]).where(key_through(views, key)).limit(batch_size)
+            )]
+            for chunk in chunks(ids):
+                conn.execute(views.delete().where(views.c.id.in_(chunk)))
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def archive_views(bind, folder, before, segment_size=100000, batch_size=500, pause=0.0, progress=None):
+    """Move views older than `before` into archive segments, oldest first.
+
+    Each segment is read in one pass, written and renamed into place before
+    any of its rows are deleted, and the deletes run `batch_size` at a time
+    so no transaction holds the write lock for long. An interrupted run is
+    finished by the next one, which first deletes everything up to the
+    newest archived view. Click rollups are kept, so stats stay complete.
+    Returns the number of views archived.
+    """
+    views = View.__table__
+    urls = Url.__table__
+    archived = 0
+    key = archived_through(folder)
+    if key is not None:
+        delete_archived(bind, key, batch_size, pause)
+    while True:
+        query = (
+            select([views.c.id, views.c.timestamp, views.c.urls_id, urls.c.alias,
+                    views.c.ip, views.c.request, views.c.header_data])
+            .select_from(views.outerjoin(urls, urls.c.id == views.c.urls_id))
+            .where(views.c.timestamp < before)
+            .order_by(views.c.timestamp, views.c.id)
+            .limit(segment_size)
+        )
+        if key is not None:
+            query = query.where(key_after(views, key))
+        with bind.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        if not rows:
+            return archived
+        write_segment(folder, rows)
+        key = (rows[-1].timestamp, rows[-1].id)
+        delete_archived(bind, key, batch_size, pause)
+        archived += len(rows)
+        if progress:
+            progress(archived)
+
+
+def iter_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        for line in segment:
+            if line.strip():
+                yield json.loads(line)
+
+
+def query_archive(folder, since=None, until=None, alias=None):
+    """Yield archived views between `since` and `until`, optionally of one alias."""
+    for first, last, _, path in list_segments(folder):
+        if (since and last < since) or (until and first >= until):
+            continue
+        for record in iter_segment(path):
+            timestamp = from_timestamp(record['timestamp'])
+            if since and timestamp < since:
+                continue
+            if until and timestamp >= until:
+                continue
+            if alias is not None and record.get('alias') != alias:
+                continue
+            yield record
+
+
+def import_segment(bind, path, batch_size=1000):
+    """Put the views of a segment back, skipping ids still in the table.
+
+    Click rollups already include these views, so they are not counted
+    again, and the next archive run removes them again since the segment
+    still holds them. Returns the number of views restored.
+    """
+    views = View.__table__
+    restored = 0
+    batch = []
+
+    def flush():
+        with bind.begin() as conn:
+            free = free_ids(conn, views, [record['id'] for record in batch])
+            rows = [{
+                'id': record['id'],
+                'timestamp': from_timestamp(record['timestamp']),
+                'urls_id': record['urls_id'],
+                'ip': record['ip'],
+                'request': record['request'],
+                'header_data': header_codec.encode(sorted(record.get('headers', {}).items())),
+            } for record in batch if record['id'] in free]
+            if rows:
+                conn.execute(views.insert(), rows)
+        return len(rows)
+
+    for record in iter_segment(path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            restored += flush()
+            batch = []
+    if batch:
+        restored += flush()
+    return restored
+
+
+def parse_day(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def archive_command(argv=None):
+    parser = argparse.ArgumentParser(description='Archive, query and restore old clicks.')
+    parser.add_argument('--folder', default=app.config['shrls_archive_folder'])
+    commands = parser.add_subparsers(dest='command')
+
+    archive = commands.add_parser('archive', help='move views older than --days into segments')
+    archive.add_argument('--days', type=int, default=app.config['shrls_view_retention_days'])
+    archive.add_argument('--segment-size', type=int, default=app.config['shrls_archive_segment_size'])
+    archive.add_argument('--batch-size', type=int, default=app.config['shrls_archive_batch_size'])
+    archive.add_argument('--pause', type=float, default=app.config['shrls_archive_pause'])
+
+    query = commands.add_parser('query', help='print archived views as NDJSON')
+    query.add_argument('--since', type=parse_day, help='YYYY-MM-DD')
+    query.add_argument('--until', type=parse_day, help='YYYY-MM-DD, exclusive')
+    query.add_argument('--alias')
+
+    restore = commands.add_parser('import', help='put the views of segments back')
+    restore.add_argument('segments', nargs='+')
+
+    options = parser.parse_args(argv)
+    if options.command == 'archive':
+        if options.days is None:
+            parser.error('no retention configured, pass --days')
+        before = datetime.datetime.now() - datetime.timedelta(days=options.days)
+
+        def progress(done):
+            sys.stderr.write('\rArchived {} views'.format(done))
+
+        done = archive_views(engine, options.folder, before, options.segment_size,
+                             options.batch_size, options.pause, progress)
+        sys.stderr.write('\rArchived {} views\n'.format(done))
+    elif options.command == 'query':
+        for record in query_archive(options.folder, options.since, options.until, options.alias):
+            sys.stdout.write(json.dumps(record) + '\n')
+    elif options.command == 'import':
+        for path in options.segments:
+            restored = import_segment(engine, path)
+            sys.stderr.write('Restored {} views from {}\n'.format(restored, path))
+    else:
+        parser.print_help()
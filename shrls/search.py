@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import (
+    or_,
+    not_,
+    select,
+    table,
+    column,
+    literal_column,
+)
+
+from shrls import app
+from shrls.models import (
+    engine,
+    Url,
+    Tag,
+)
+
+SEARCH_MODES = ['+', '-', '#', '/']
+
+
+def parse_search(searches):
+    """Split admin search strings into terms by mode.
+
+    Words following `-` are excluded, `#` matches tag names, `/` matches
+    the start of an alias or a path segment of the location and anything
+    else (`+`) matches the alias, location or tags.
+    """
+    t = {mode: [] for mode in SEARCH_MODES}
+
+    searches = [[word for word in x.split(' ') if word] for x in searches if x]
+    for search in searches:
+        mode = '+'
+        phrase = []
+        for word in search:
+            if word and word[0] in t.keys():
+                if phrase:
+                    t[mode].append(' '.join(phrase))
+                phrase = []
+                mode = word[0]
+                word = word[1:]
+            if word:
+                phrase.append(word)
+        t[mode].append(' '.join(phrase))
+    return t
+
+
+class LikeSearchIndex(object):
+    """Matches search terms with ILIKE against the urls and tags tables."""
+
+    def filter(self, query, t):
+        for f in t['/']:
+            query = query.filter(or_(
+                Url.alias.ilike("{}%".format(f)),
+                Url.location.ilike("%/{}%".format(f)),
+            ))
+
+        for f in t['#']:
+            query = query.filter(
+                Url.tags.any(Tag.name.ilike("%{}%".format(f)))
+            )
+
+        for f in t['+']:
+            query = query.filter(or_(
+                Url.alias.ilike("%{}%".format(f)),
+                Url.location.ilike("%{}%".format(f)),
+                Url.tags.any(Tag.name.ilike("%{}%".format(f))),
+            ))
+
+        for f in t['-']:
+            query = query.filter(not_(or_(
+                Url.alias.ilike("%{}%".format(f)),
+                Url.location.ilike("%{}%".format(f)),
+            )))
+        return query
+
+
+class Fts5SearchIndex(LikeSearchIndex):
+    """Narrows searches with the `urls_search` trigram FTS5 table.
+
+    Every term of three or more characters first restricts the urls to the
+    ids matching it in the index. The ILIKE filters are then only checked
+    against those rows, which keeps the results identical to
+    LikeSearchIndex. Shorter terms cannot use trigrams and fall back to
+    scanning.
+    """
+
+    min_length = 3
+    table = table('urls_search', column('rowid'))
+
+    def matching(self, columns, f):
+        phrase = '{%s} : "%s"' % (' '.join(columns), f.replace('"', '""'))
+        return select([self.table.c.rowid]).where(
+            literal_column(self.table.name).match(phrase)
+        )
+
+    def filter(self, query, t):
+        t = dict(t)
+        for mode, columns in [('/', ['alias', 'location']),
+                              ('#', ['tags']),
+                              ('+', ['alias', 'location', 'tags'])]:
+            for f in t[mode]:
+                if len(f) >= self.min_length:
+                    query = query.filter(Url.id.in_(self.matching(columns, f)))
+
+        negated = [f for f in t['-'] if len(f) >= self.min_length]
+        for f in negated:
+            query = query.filter(not_(Url.id.in_(self.matching(['alias', 'location'], f))))
+        t['-'] = [f for f in t['-'] if f not in negated]
+        return super(Fts5SearchIndex, self).filter(query, t)
+
+
+_search_index = None
+
+
+def get_search_index():
+    global _search_index
+    if _search_index is None:
+        _search_index = LikeSearchIndex()
+        if app.config['shrls_search_index'] == 'fts5' and engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'urls_search'"
+                ).first()
+            if exists:
+                _search_index = Fts5SearchIndex()
+            else:
+                app.logger.warning('urls_search is missing, searches will use LIKE. migrate_shrls_db '
+                                   'creates it where SQLite has the FTS5 trigram tokenizer')
+    return _search_index
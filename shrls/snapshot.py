@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Read only alias -> redirect candidates snapshots for redirect nodes.
+
+    build_alias_snapshot --output /srv/shrls/aliases.snapshot
+
+A snapshot holds every `Url.alias` with its (url id, location) candidates,
+the same tuples lookup_alias returns. The layout is
+
+    header   magic, alias count, index offset
+    records  alias length, alias, candidate count,
+             then (url id, location length, location) per candidate
+    index    (64 bit alias hash, record offset), sorted by hash
+
+Readers mmap the file and binary search the index in place, so nothing is
+loaded up front and every worker process shares the same pages. A new
+snapshot is written next to the old one and renamed over it. Readers
+notice the new file within shrls_alias_snapshot_check_interval seconds and
+map it instead.
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from shrls import app
+from shrls.models import (
+    read_engine,
+    Url,
+)
+
+MAGIC = b'SHRLSAS1'
+HEADER = struct.Struct('<8sQQ')
+ENTRY = struct.Struct('<QQ')
+ALIAS = struct.Struct('<H')
+COUNT = struct.Struct('<I')
+CANDIDATE = struct.Struct('<qi')
+# Location length of a null location
+NULL = -1
+
+Mapped = namedtuple('Mapped', ['identity', 'map', 'count', 'index'])
+
+
+def alias_hash(encoded):
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little')
+
+
+def encode_record(encoded, candidates):
+    parts = [ALIAS.pack(len(encoded)), encoded, COUNT.pack(len(candidates))]
+    for url_id, location in candidates:
+        if location is None:
+            parts.append(CANDIDATE.pack(url_id, NULL))
+        else:
+            location = location.encode('utf-8')
+            parts.append(CANDIDATE.pack(url_id, len(location)))
+            parts.append(location)
+    return b''.join(parts)
+
+
+def iter_aliases(bind, batch_size=10000):
+    """Yield (alias, candidates) for every alias, candidates ordered by url id."""
+    urls = Url.__table__
+    query = (
+        select([urls.c.alias, urls.c.id, urls.c.location])
+        .where(urls.c.alias.isnot(None))
+        .order_by(urls.c.alias, urls.c.id)
+    )
+    alias = None
+    candidates = []
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row.alias != alias:
+                    if candidates:
+                        yield alias, tuple(candidates)
+                    alias = row.alias
+                    candidates = []
+                candidates.append((row.id, row.location))
+    if candidates:
+        yield alias, tuple(candidates)
+
+
+def write_snapshot(path, aliases):
+    """Write (alias, candidates) pairs to a snapshot at `path`, atomically.
+
+    Records are streamed to a temporary file in the same folder, only the
+    16 byte index entries are kept in memory. Returns the alias count.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as snapshot:
+            snapshot.write(HEADER.pack(MAGIC, 0, 0))
+            offset = HEADER.size
+            index = []
+            for alias, candidates in aliases:
+                encoded = alias.encode('utf-8')
+                record = encode_record(encoded, candidates)
+                index.append((alias_hash(encoded), offset))
+                snapshot.write(record)
+                offset += len(record)
+            index.sort()
+            for entry in index:
+                snapshot.write(ENTRY.pack(*entry))
+            snapshot.seek(0)
+            snapshot.write(HEADER.pack(MAGIC, len(index), offset))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(index)
+
+
+def build_snapshot(bind, path):
+    return write_snapshot(path, iter_aliases(bind))
+
+
+class AliasSnapshot(object):
+    """Looks aliases up in the snapshot at `path`, if there is one.
+
+    get() returns the candidates of an alias, or None when there is no
+    snapshot or the alias is not in it, so callers fall back to the
+    database. The file is checked for a replacement at most every
+    `check_interval` seconds. Superseded maps are left to be closed once
+    no lookup holds them any more.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mapped = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        mapped = self.current()
+        return mapped.count if mapped else 0
+
+    def current(self):
+        if not self.path:
+            return None
+        now = time.time()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            with self._lock:
+                if self._checked is None or now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._mapped = self._load(self._mapped)
+        return self._mapped
+
+    def _load(self, mapped):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if mapped is not None and mapped.identity == identity:
+            return mapped
+        try:
+            with open(self.path, 'rb') as snapshot:
+                mm = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count, index = HEADER.unpack_from(mm, 0)
+        except (OSError, ValueError, struct.error):
+            app.logger.exception('Unable to map the alias snapshot %s', self.path)
+            return mapped
+        if magic != MAGIC or index + count * ENTRY.size != len(mm):
+            app.logger.error('%s is not an alias snapshot', self.path)
+            return mapped
+        return Mapped(identity, mm, count, index)
+
+    def get(self, alias):
+        mapped = self.current()
+        if mapped is None or not mapped.count:
+            return None
+        mm = mapped.map
+        encoded = alias.encode('utf-8')
+        key = alias_hash(encoded)
+        low, high = 0, mapped.count
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(mm, mapped.index + middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        # Hash collisions sit next to each other in the index
+        while low < mapped.count:
+            entry_hash, offset = ENTRY.unpack_from(mm, mapped.index + low * ENTRY.size)
+            if entry_hash != key:
+                break
+            candidates = self._read(mm, offset, encoded)
+            if candidates is not None:
+                return candidates
+            low += 1
+        return None
+
+    def _read(self, mm, offset, encoded):
+        (length,) = ALIAS.unpack_from(mm, offset)
+        offset += ALIAS.size
+        if mm[offset:offset + length] != encoded:
+            return None
+        offset += length
+        (count,) = COUNT.unpack_from(mm, offset)
+        offset += COUNT.size
+        candidates = []
+        for _ in range(count):
+            url_id, length = CANDIDATE.unpack_from(mm, offset)
+            offset += CANDIDATE.size
+            if length == NULL:
+                candidates.append((url_id, None))
+            else:
+                candidates.append((url_id, mm[offset:offset + length].decode('utf-8')))
+                offset += length
+        return tuple(candidates)
+
+
+alias_snapshot = AliasSnapshot(
+    app.config['shrls_alias_snapshot'],
+    check_interval=app.config['shrls_alias_snapshot_check_interval'],
+)
+
+
+def snapshot_command(argv=None):
+    parser = argparse.ArgumentParser(description='Compile every alias into a snapshot for redirect nodes.')
+    parser.add_argument('--output', default=app.config['shrls_alias_snapshot'],
+                        help='defaults to shrls_alias_snapshot')
+    options = parser.parse_args(argv)
+    if not options.output:
+        parser.error('no shrls_alias_snapshot configured, pass --output')
+    start = time.time()
+    count = build_snapshot(read_engine, options.output)
+    sys.stderr.write('Wrote {} aliases to {} in {:.1f}s\n'.format(count, options.output, time.time() - start))
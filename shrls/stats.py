@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+import argparse
+from collections import Counter
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from sqlalchemy import select, func, bindparam
+
+from shrls.bulk import chunks
+from shrls.headers import header_codec
+from shrls.models import (
+    engine,
+    View,
+    ClickRollup,
+)
+
+GRANULARITIES = ['hour', 'day']
+DIMENSIONS = ['total', 'referrer', 'agent']
+
+# First match wins, so more specific families come before the ones whose
+# tokens they also send (Edge and Opera claim to be Chrome and Safari).
+USER_AGENT_FAMILIES = [
+    ('Bot', re.compile(r'bot|crawl|spider|slurp|preview|facebookexternalhit', re.I)),
+    ('curl', re.compile(r'^curl/')),
+    ('wget', re.compile(r'^Wget/')),
+    ('Python', re.compile(r'python-requests|python-urllib|aiohttp', re.I)),
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('Opera', re.compile(r'OPR/|Opera')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Safari', re.compile(r'Safari/')),
+    ('Internet Explorer', re.compile(r'MSIE |Trident/')),
+]
+
+
+def user_agent_family(user_agent):
+    if not user_agent:
+        return '(none)'
+    for family, pattern in USER_AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return 'Other'
+
+
+def referrer_host(referrer):
+    host = urlparse(referrer or '').netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or '(direct)'
+
+
+def truncate(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_keys(urls_id, timestamp, headers):
+    """Every (urls_id, granularity, dimension, period, value) a click counts towards."""
+    headers = {k.lower(): v for k, v in headers}
+    values = [
+        ('total', ''),
+        ('referrer', referrer_host(headers.get('referer'))),
+        ('agent', user_agent_family(headers.get('user-agent'))),
+    ]
+    return [
+        (urls_id, granularity, dimension, truncate(timestamp, granularity), value)
+        for granularity in GRANULARITIES
+        for dimension, value in values
+    ]
+
+
+def apply_rollups(conn, counts):
+    """Add a Counter of rollup keys to the click_rollups table."""
+    rollups = ClickRollup.__table__
+    key_columns = [rollups.c.urls_id, rollups.c.granularity, rollups.c.dimension,
+                   rollups.c.period, rollups.c.value]
+    existing = {}
+    for chunk in chunks(counts, 200):
+        for row in conn.execute(
+                select(key_columns + [rollups.c.id])
+                .where(rollups.c.urls_id.in_(set(key[0] for key in chunk)))
+                .where(rollups.c.period.in_(set(key[3] for key in chunk)))):
+            if tuple(row[:-1]) in counts:
+                existing[tuple(row[:-1])] = row[-1]
+    updates = [{'rollup_id': existing[key], 'delta': n} for key, n in counts.items() if key in existing]
+    inserts = [dict(zip(['urls_id', 'granularity', 'dimension', 'period', 'value'], key), clicks=n)
+               for key, n in counts.items() if key not in existing]
+    if updates:
+        conn.execute(
+            rollups.update()
+            .where(rollups.c.id == bindparam('rollup_id'))
+            .values(clicks=rollups.c.clicks + bindparam('delta')),
+            updates
+        )
+    if inserts:
+        conn.execute(rollups.insert(), inserts)
+
+
+def backfill_rollups(bind, batch_size=10000, progress=None):
+    """Rebuild click_rollups from the raw views table.
+
+    The rollups are cleared in the same transaction that notes the newest
+    view, so clicks recorded while the backfill runs are counted once by
+    the click recorder and never by the backfill. Views already moved to
+    the archive by shrls.retention are lost from the rebuilt rollups.
+    """
+    views = View.__table__
+    with bind.begin() as conn:
+        last_id = conn.execute(select([func.max(views.c.id)])).scalar() or 0
+        conn.execute(ClickRollup.__table__.delete())
+    done = 0
+    next_id = 0
+    while next_id < last_id:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select([views.c.id, views.c.urls_id, views.c.timestamp, views.c.header_data])
+                .where(views.c.id > next_id)
+                .where(views.c.id <= last_id)
+                .order_by(views.c.id)
+                .limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            counts = Counter()
+            for row in rows:
+                if row.timestamp is None:
+                    continue
+                headers = header_codec.decode(row.header_data).items()
+                counts.update(rollup_keys(row.urls_id, row.timestamp, headers))
+            apply_rollups(conn, counts)
+        next_id = rows[-1].id
+        done += len(rows)
+        if progress:
+            progress(done)
+    return done
+
+
+def backfill_command(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild the click rollups from the raw views.')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    options = parser.parse_args(argv)
+
+    def progress(done):
+        sys.stderr.write('\rRolled up {} views'.format(done))
+
+    done = backfill_rollups(engine, batch_size=options.batch_size, progress=progress)
+    sys.stderr.write('\rRolled up {} views\n'.format(done))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from shrls import app
+
+# Room for the multipart boundaries and the other form fields of an upload
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    pass
+
+
+class IncomingUpload(object):
+    """A temporary file in the upload store, hashed as it is written.
+
+    Removed on close() unless UploadStore.commit() moved it into place.
+    """
+
+    def __init__(self, store):
+        if not os.path.exists(store.root):
+            os.makedirs(store.root, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='.upload-', dir=store.root)
+        self.file = os.fdopen(fd, 'w+b')
+        self.max_size = store.max_size
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.close()
+            raise UploadTooLarge('Uploads are limited to {} bytes'.format(self.max_size))
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadStore(object):
+    """Content addressed files, each stored once under its sha256 digest.
+
+    Uploads are hashed while they are written to a temporary file next to
+    the blobs, then renamed into place, or dropped if that content is
+    already stored. Blobs are never modified once written.
+    """
+
+    def __init__(self, root, max_size=None, chunk_size=65536):
+        self.root = root
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def incoming(self):
+        return IncomingUpload(self)
+
+    def commit(self, incoming):
+        """Move a fully written upload into place, returning (digest, size)."""
+        digest = incoming.sha256.hexdigest()
+        path = self.path(digest)
+        incoming.file.close()
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(incoming.path, path)
+        incoming.close()
+        return digest, incoming.size
+
+    def put(self, stream):
+        """Store the contents of `stream`, returning (digest, size)."""
+        incoming = self.incoming()
+        try:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                incoming.write(chunk)
+            return self.commit(incoming)
+        except BaseException:
+            incoming.close()
+            raise
+
+
+upload_store = UploadStore(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'),
+    max_size=app.config['shrls_upload_max_size'],
+)
+
+
+class UploadRequest(Request):
+    """Streams /admin/upload files straight into the upload store.
+
+    werkzeug parses the multipart body into the IncomingUpload returned by
+    the stream factory, so the file is hashed as it arrives and written to
+    disk once. Requests larger than shrls_upload_max_size are refused with
+    a 413 before their body is read.
+    """
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_file' and upload_store.max_size is not None:
+            return upload_store.max_size + UPLOAD_FORM_OVERHEAD
+        return super(UploadRequest, self).max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file':
+            return upload_store.incoming()
+        return super(UploadRequest, self)._get_file_stream(
+            total_content_length, content_type, filename, content_length)
+
+
+app.request_class = UploadRequest
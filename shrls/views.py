@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
+import hmac
+import time
 import random
 import json
+import base64
+import hashlib
 import datetime
+import mimetypes
 from functools import wraps
 
 from flask import (
@@ -13,29 +17,76 @@ from flask import (
     make_response,
     request,
     Response,
+    send_file,
     send_from_directory,
     session,
     jsonify,
+    stream_with_context,
 )
 from werkzeug import secure_filename
 from oath import GoogleAuthenticator
 
 from shrls import app
 from shrls.models import (
+    engine,
     DBSession,
+    ReadSession,
     Url,
     Tag,
     Snippet,
+    Upload,
     View,
-    Header,
+    ClickRollup,
     allowed_shortner_chars,
+    alias_allocator,
+    create_short_url,
+    tags_to_urls_table,
 )
+from shrls.backup import (
+    BackupReader,
+    buffered,
+    gzipped,
+    iter_backup_json,
+    iter_backup_ndjson,
+    iter_restore,
+)
+from shrls.bulk import create_urls
+from shrls.cache import alias_cache, chain_cache, tag_cache, snippet_cache
+from shrls.counters import view_counters
+from shrls.headers import header_codec
+from shrls.metrics import metrics
+from shrls.recorder import click_recorder
+from shrls.stats import GRANULARITIES, DIMENSIONS, truncate
+from shrls.search import get_search_index, parse_search
+from shrls.snapshot import alias_snapshot
+from shrls.uploads import upload_store, IncomingUpload
 
 from sqlalchemy import (
     or_,
-    not_,
+    and_,
+    asc,
     desc,
+    func,
+    nullsfirst,
+    nullslast,
 )
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
+
+
+_users_index = {'users': None, 'by_name': {}}
+
+
+def users_by_name():
+    """shrls_users keyed by username, rebuilt when the list is replaced."""
+    users = app.config.get('shrls_users') or []
+    if _users_index['users'] is not users:
+        by_name = {}
+        for user in users:
+            by_name.setdefault(user['shrls_username'], user)
+        _users_index['by_name'] = by_name
+        _users_index['users'] = users
+    return _users_index['by_name']
 
 
 def check_auth(username, password):
@@ -43,26 +94,33 @@ def check_auth(username, password):
     password combination is valid.
     """
     obj = {'login': False}
-    authenticated = session.get('login_key')
-    for user in app.config.get('shrls_users'):
-
+    user = users_by_name().get(username)
+    if user:
         if user.get('shrls_totp'):
-            a = GoogleAuthenticator(user['shrls_totp'])
-            if all([username == user['shrls_username'],
-                    password == a.generate()]) or authenticated == app.config.get('login_key'):
-                session['login_key'] = app.config.get('login_key')
-                obj['login'] = True
-                break
+            expected = GoogleAuthenticator(user['shrls_totp']).generate()
         else:
-            if all([username == user['shrls_username'],
-                    password == user['shrls_password']]):
-                obj['login'] = True
-                break
+            expected = user.get('shrls_password')
+        obj['login'] = expected is not None and hmac.compare_digest(
+            str(password).encode('utf-8'), str(expected).encode('utf-8'))
     if obj['login']:
         obj['admin'] = user.get('shrls_admin')
     return obj
 
 
+def session_login(username):
+    """True if the signed session cookie holds an unexpired login of `username`.
+
+    TOTP users keep sending the code they logged in with, so this is what
+    keeps them logged in. Changing login_key logs everyone out.
+    """
+    login = session.get('auth')
+    return bool(login) and all([
+        login.get('user') == username,
+        login.get('key') == app.config.get('login_key'),
+        login.get('expires', 0) > time.time(),
+    ])
+
+
 def authenticate():
     """Sends a 401 response that enables basic auth"""
     return Response(
@@ -76,12 +134,18 @@ def requires_auth(f):
     def decorated(*args, **kwargs):
         auth = request.authorization
         if not auth or 'logout' in request.args:
+            session.pop('auth', None)
             return authenticate()
-        is_login = check_auth(auth.username, auth.password)
-        if is_login['login']:
+        if not session_login(auth.username):
+            is_login = check_auth(auth.username, auth.password)
+            if not is_login['login']:
+                return authenticate()
+            session['auth'] = {
+                'user': auth.username,
+                'key': app.config.get('login_key'),
+                'expires': time.time() + app.config['shrls_auth_ttl'],
+            }
             session['admin'] = is_login['admin']
-        else:
-            return authenticate()
         return f(*args, **kwargs)
     return decorated
 
@@ -104,6 +168,40 @@ def index():
     return not_found()
 
 
+SNIPPET_FORMATS = {
+    None: 'html',
+    'txt': 'txt',
+    'asc': 'gpg',
+    'pgp': 'gpg',
+    'gpg': 'gpg',
+}
+
+
+def render_snippet(alias, kind):
+    rendered = snippet_cache.get((alias, kind))
+    if rendered is None:
+        snippet = ReadSession.query(Snippet).filter(Snippet.alias == alias).first()
+        if not snippet:
+            return None
+        if kind == 'txt':
+            body = snippet.content
+            content_type = 'text/plain; charset=utf-8'
+        elif kind == 'gpg':
+            body = render_template('gpg.html', code=snippet)
+            content_type = 'text/html; charset=utf-8'
+        else:
+            body = render_template('snippet.html', code=snippet)
+            content_type = 'text/html; charset=utf-8'
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        rendered = (snippet.id, body, content_type, etag)
+        snippet_cache.set((alias, kind), rendered)
+    return rendered
+
+
+def invalidate_snippet(alias):
+    snippet_cache.invalidate(*[(alias, kind) for kind in set(SNIPPET_FORMATS.values())])
+
+
 @app.route('/code/<url_id>')
 @app.route('/c/<url_id>')
 def render_code_snippet(url_id):
@@ -112,97 +210,171 @@ def render_code_snippet(url_id):
     file_format = None
     if len(url_parts) > 1:
         file_format = url_parts[-1].lower()
-    redirect_obj = DBSession.query(Snippet).filter(Snippet.alias == url_id).first()
-    if redirect_obj:
-        redirect_obj.views += 1
-        DBSession.add(redirect_obj)
-        DBSession.commit()
-        if file_format:
-            if file_format in ['txt']:
-                response = make_response(redirect_obj.content)
-                response.headers['Content-Type'] = 'text/plain; charset=utf-8'
-                return response
-            elif file_format in ['asc', 'pgp', 'gpg']:
-                return render_template('gpg.html', code=redirect_obj)
-        else:
-            return render_template('snippet.html', code=redirect_obj)
-    return not_found()
+    kind = SNIPPET_FORMATS.get(file_format)
+    rendered = kind and render_snippet(url_id, kind)
+    if not rendered:
+        return not_found()
+    snippet_id, body, content_type, etag = rendered
+    view_counters.hit_snippet(snippet_id)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(body)
+        response.headers['Content-Type'] = content_type
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/uploads/<path:filename>')
 @app.route('/u/<path:filename>')
 def return_uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve an upload with its digest as ETag.
+
+    A name can be uploaded again with new content, so /u/<name> has to be
+    revalidated by clients. /u/<name>?v=<digest> always has the same
+    content and may be cached for shrls_upload_cache_seconds.
+    """
+    upload = ReadSession.query(Upload.digest).filter(Upload.name == filename).first()
+    if not upload or not upload_store.exists(upload.digest):
+        # Uploaded before the upload store, saved under their own name
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    immutable = request.args.get('v') == upload.digest
+    if upload.digest in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = send_file(
+            upload_store.path(upload.digest),
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            add_etags=False,
+            cache_timeout=app.config['shrls_upload_cache_seconds'] if immutable else 0,
+        )
+    response.set_etag(upload.digest)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['shrls_upload_cache_seconds']
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+        del response.headers['Expires']
+    return response
+
+
+def resolve_redirect_chain(original_url):
+    """Follow redirects through our own aliases without recursing.
+
+    Returns the url ids passed through and the final location. Stops at
+    the first location outside shrls_base_url, an unknown alias, an alias
+    seen before in the chain or after shrls_max_redirect_hops hops.
+    """
+    base_url = app.config['shrls_base_url']
+    location = original_url
+    hops = []
+    seen = set()
+    deterministic = True
+    while len(hops) < app.config['shrls_max_redirect_hops']:
+        if not location.startswith(base_url):
+            break
+        alias = location[(len(base_url) + 1):]
+        if alias in seen:
+            break
+        seen.add(alias)
+        candidates = lookup_alias(alias)
+        if not candidates:
+            break
+        deterministic = deterministic and len(candidates) == 1
+        url_id, location = random.choice(candidates)
+        hops.append(url_id)
+    return tuple(hops), location, deterministic
 
 
 def remove_extra_redirects(original_url):
-    if not original_url.startswith(app.config['shrls_base_url']):
-        return original_url
-    url = original_url[(len(app.config['shrls_base_url']) + 1):]
-    urls = DBSession.query(Url).filter(Url.alias == url).all()
-    if not urls:
-        return original_url
-    url = random.choice(urls)
-    url.views += 1
-    DBSession.add(url)
-    DBSession.commit()
-    return remove_extra_redirects(url.location)
+    chain = chain_cache.get(original_url)
+    if chain is None:
+        hops, location, deterministic = resolve_redirect_chain(original_url)
+        if deterministic:
+            chain_cache.set(original_url, (hops, location))
+    else:
+        hops, location = chain
+    view_counters.hit_url(*hops)
+    return location
+
+
+def lookup_tag(tagname):
+    aliases = tag_cache.get(tagname)
+    if aliases is None:
+        query = ReadSession.query(Url.alias).join(Url.tags).filter(Tag.name == tagname)
+        aliases = tuple(alias for (alias,) in query)
+        tag_cache.set(tagname, aliases)
+    return aliases
 
 
 @app.route('/t/<path:tagname>')
 def return_tagged_url(tagname):
-    tag = DBSession.query(Tag).filter(Tag.name == tagname).first()
-    if not tag:
-        return not_found()
-    urls = tag.urls
-    if not urls:
+    aliases = lookup_tag(tagname)
+    if not aliases:
         return not_found()
 
-    url = random.choice(urls)
-    location = '{}/{}'.format(app.config['shrls_base_url'], url.alias)
+    alias = random.choice(aliases)
+    location = '{}/{}'.format(app.config['shrls_base_url'], alias)
     location = remove_extra_redirects(location)
     return redirect(location, code=302)
 
 
-def record_view(url):
-    view = View(url.id, request.environ['HTTP_X_REAL_IP'], request.url)
-    for k, v in request.headers.items():
-        view.headers.append(Header(k, v))
-    DBSession.add(view)
-    DBSession.commit()
+def record_view(url_id):
+    click_recorder.record(
+        url_id,
+        request.environ['HTTP_X_REAL_IP'],
+        request.url,
+        list(request.headers.items()),
+    )
+
+
+def lookup_alias(alias):
+    candidates = alias_snapshot.get(alias)
+    if candidates is not None:
+        return candidates
+    candidates = alias_cache.get(alias)
+    if candidates is None:
+        candidates = tuple(
+            (url_id, location) for url_id, location in
+            ReadSession.query(Url.id, Url.location).filter(Url.alias == alias)
+        )
+        alias_cache.set(alias, candidates)
+    return candidates
+
+
+def find_redirect_candidates(url_id):
+    base = url_id.split('/')[0]
+    filters = url_id.split('/')[1:]
+    url_id = url_id.split('.')[0]
+    candidates = lookup_alias(url_id)
+    if not candidates:
+        candidates = lookup_alias(base)
+    if filters and len(candidates) > 1:
+        for f in filters:
+            candidates = [c for c in candidates if f.lower() in (c[1] or '').lower()]
+    return candidates
 
 
 @app.route('/<path:url_id>')
 def url_redirect(url_id):
     extras = request.url.split('?')[1:]
-    base = url_id.split('/')[0]
-    filters = url_id.split('/')[1:]
-    print("{}: {}".format(request.environ['PATH_INFO'], request.environ['HTTP_X_FORWARDED_FOR']))
+    forwarded_for = request.environ.get('HTTP_X_FORWARDED_FOR')
+    app.logger.debug('%s: %s', request.environ['PATH_INFO'], forwarded_for)
     canned_responses = {
     }
-    response = canned_responses.get(request.environ['HTTP_X_FORWARDED_FOR'])
+    response = canned_responses.get(forwarded_for)
     if response:
         return response
-    url_id = url_id.split('.')[0]
-    query = DBSession.query(Url).filter(Url.alias == url_id)
-    if query.count() == 0:
-        query = DBSession.query(Url).filter(Url.alias == base)
-    if filters and query.count() > 1:
-        for f in filters:
-            query = query.filter(Url.location.ilike("%{}%".format(f)))
-    redirect_obj = query.all()
-    if redirect_obj:
-        redirect_obj = random.choice(redirect_obj)
-        location = redirect_obj.location
-        record_view(redirect_obj)
+    candidates = find_redirect_candidates(url_id)
+    if candidates:
+        redirect_id, location = random.choice(candidates)
+        record_view(redirect_id)
 
         if extras:
             if not extras[0].startswith('/'):
                 location += '/'
             location += extras[0]
-        redirect_obj.views += 1
-        DBSession.add(redirect_obj)
-        DBSession.commit()
         return redirect(location, code=302)
     return not_found()
 
@@ -210,7 +382,10 @@ def url_redirect(url_id):
 @app.route('/admin/info/')
 @requires_auth
 def all_info():
-    requests = DBSession.query(View).order_by(View.timestamp.desc()).limit(25).all()
+    views = DBSession.query(View).options(joinedload(View.url))
+    views, next_cursor, error = page_views(views)
+    if error:
+        return Response(error, 400)
 
     info_obj = {}
     info_obj['requests'] = [{
@@ -218,9 +393,10 @@ def all_info():
         'timestamp': r.timestamp,
         'ip': r.ip,
         'path': r.request,
-        'alias': r.url.alias,
-        'headers': {header.key: header.value for header in r.headers},
-    } for r in requests]
+        'alias': r.url.alias if r.url else None,
+        'headers': header_codec.decode(r.header_data),
+    } for r in views]
+    info_obj['next_cursor'] = next_cursor
     return jsonify(info_obj)
 
 
@@ -229,7 +405,24 @@ def all_info():
 def url_info(url_id):
     url_id = url_id.split('.')[0]
     info_obj = {}
-    urls = DBSession.query(Url).filter(Url.alias == url_id).all()
+    urls = DBSession.query(Url).options(selectinload(Url.tags)).filter(Url.alias == url_id).all()
+
+    # One page of the combined request history of every url with this alias
+    requests = {url.id: {} for url in urls}
+    next_cursor = None
+    if urls:
+        views = DBSession.query(View).filter(View.urls_id.in_(list(requests)))
+        views, next_cursor, error = page_views(views)
+        if error:
+            return Response(error, 400)
+        for r in views:
+            requests[r.urls_id][r.id] = {
+                'timestamp': r.timestamp,
+                'ip': r.ip,
+                'path': r.request,
+                'alias': url_id,
+                'headers': header_codec.decode(r.header_data),
+            }
 
     info_obj['urls'] = []
     for url in urls:
@@ -238,84 +431,120 @@ def url_info(url_id):
             'created_at': url.created_at,
             'alias': url.alias,
             'location': url.location,
-            'views': url.views,
+            'views': view_counters.with_pending(Url.__table__, url.id, url.views),
             'tags': [t.name for t in url.tags],
-            'requests': {r.id: {
-                'timestamp': r.timestamp,
-                'ip': r.ip,
-                'path': r.request,
-                'alias': r.url.alias,
-                'headers': {header.key: header.value for header in r.headers},
-            } for r in url.requests.order_by(desc(View.timestamp)).limit(25)},
+            'requests': requests[url.id],
         })
+    info_obj['next_cursor'] = next_cursor
     return jsonify(info_obj)
 
 
+@app.route('/admin/api/stats/<path:url_id>')
+@requires_auth
+def get_stats_api(url_id):
+    granularity = request.args.get('granularity', 'day')
+    dimension = request.args.get('dimension', 'total')
+    if granularity not in GRANULARITIES or dimension not in DIMENSIONS:
+        return Response('Unknown granularity or dimension', 400)
+    days = request.args.get('days', type=int)
+    if days is None and 'days' in request.args:
+        return Response('days must be a whole number', 400)
+    if days is None:
+        days = 30
+    days = min(max(days, 1), app.config['shrls_stats_max_days'])
+    since = truncate(datetime.datetime.now() - datetime.timedelta(days=days), granularity)
+
+    clicks = func.sum(ClickRollup.clicks)
+    rows = DBSession.query(ClickRollup.period, ClickRollup.value, clicks).join(
+        Url, Url.id == ClickRollup.urls_id
+    ).filter(
+        Url.alias == url_id.split('.')[0],
+        ClickRollup.granularity == granularity,
+        ClickRollup.dimension == dimension,
+        ClickRollup.period >= since,
+    ).group_by(ClickRollup.period, ClickRollup.value).order_by(ClickRollup.period, desc(clicks))
+
+    return jsonify({
+        'alias': url_id,
+        'granularity': granularity,
+        'dimension': dimension,
+        'since': since,
+        'stats': [{
+            'period': period,
+            'value': value,
+            'clicks': count,
+        } for period, value, count in rows],
+    })
+
+
+metrics.register_gauge('shrls_click_queue_size', 'Clicks waiting to be written.',
+                       lambda: click_recorder.queue.qsize())
+metrics.register_gauge('shrls_clicks_dropped', 'Clicks dropped because the queue was full.',
+                       lambda: click_recorder.dropped)
+metrics.register_gauge('shrls_clicks_failed', 'Clicks lost to failed writes.',
+                       lambda: click_recorder.failed)
+metrics.register_gauge('shrls_view_counter_failed_flushes', 'View count flushes that failed.',
+                       lambda: view_counters.failed)
+metrics.register_gauge('shrls_alias_cache_entries', 'Entries in the alias cache.',
+                       lambda: len(alias_cache))
+metrics.register_gauge('shrls_alias_snapshot_aliases', 'Aliases in the mapped alias snapshot.',
+                       lambda: len(alias_snapshot))
+
+
+@app.route('/admin/metrics')
+@requires_auth
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/admin/backup/')
 @requires_auth
 def backup():
-    urls = DBSession.query(Url).all()
-    snippets = DBSession.query(Snippet).all()
-    backup_obj = {
-        'urls': [],
-        'snippets': [],
-    }
-    for url in urls:
-        obj = {
-            'id': url.id,
-            'alias': url.alias,
-            'location': url.location,
-            'views': url.views,
-        }
-        if url.created_at:
-            obj['created_at'] = (url.created_at - datetime.datetime(1970, 1, 1)).total_seconds()
-        else:
-            obj['created_at'] = 0
-        obj['tags'] = [x.name for x in url.tags]
-        backup_obj['urls'].append(obj)
-    for snippet in snippets:
-        obj = {
-            'id': snippet.id,
-            'alias': snippet.alias,
-            'title': snippet.title,
-            'content': snippet.content,
-            'views': snippet.views,
-        }
-        if snippet.created_at:
-            obj['created_at'] = (snippet.created_at - datetime.datetime(1970, 1, 1)).total_seconds()
-        else:
-            obj['created_at'] = 0
-        backup_obj['snippets'].append(obj)
-    return jsonify(backup_obj)
+    view_counters.flush()
+    if request.args.get('format') == 'ndjson':
+        pieces = iter_backup_ndjson(engine)
+        mimetype = 'application/x-ndjson'
+        filename = 'shrls-backup.ndjson'
+    else:
+        pieces = iter_backup_json(engine)
+        mimetype = 'application/json'
+        filename = 'shrls-backup.json'
+    chunks = buffered(pieces)
+    if request.args.get('compress') == 'gzip':
+        chunks = gzipped(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    response = Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+    return response
 
 
 @app.route('/admin/restore/', methods=['POST'])
 @requires_auth
 def restore():
     payload = request.files['file']
-    payload = json.loads(payload.read())
-    db_entities = []
-    known_tags = {}
-    for url in payload['urls']:
-        u = Url(url['location'], url['alias'], url['views'])
-        for tag in url['tags']:
-            if tag not in known_tags:
-                known_tags[tag] = Tag(tag)
-        url['tags'] = [known_tags[tag] for tag in url['tags']]
-        for k, v in url.items():
-            setattr(u, k, v)
-        u.created_at = datetime.datetime.fromtimestamp(url['created_at'])
-        db_entities.append(u)
-    for snip in payload['snippets']:
-        s = Snippet(snip['content'], snip['title'], snip['alias'], snip['views'])
-        for k, v in snip.items():
-            setattr(s, k, v)
-        s.created_at = datetime.datetime.fromtimestamp(snip['created_at'])
-        db_entities.append(s)
-    DBSession.add_all(db_entities)
-    DBSession.commit()
-    return redirect('/admin/', code=302)
 
+    def restored():
+        counts = {}
+        try:
+            for counts in iter_restore(engine, payload.stream):
+                app.logger.info('Restored %(urls)d urls and %(snippets)d snippets', counts)
+                yield counts
+        finally:
+            alias_cache.clear()
+            chain_cache.clear()
+            tag_cache.clear()
+            snippet_cache.clear()
+            alias_allocator.reset()
+        counts['done'] = True
+        yield counts
+
+    if request.args.get('progress'):
+        lines = (json.dumps(counts) + '\n' for counts in restored())
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    for _ in restored():
+        pass
+    return redirect('/admin/', code=302)
 
 
 @app.route('/admin/api/snippet')
@@ -330,17 +559,99 @@ def get_snippets():
         'alias': x.alias,
         'title': x.title,
         'content': x.content,
-        'views': x.views,
+        'views': view_counters.with_pending(Snippet.__table__, x.id, x.views),
     } for x in snippets]
     return jsonify(final)
 
 
+CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime.datetime):
+        value = value.strftime(CURSOR_TIME_FORMAT)
+    payload = json.dumps([value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor, order_by):
+    value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if order_by in ('created_at', 'timestamp') and value is not None:
+        value = datetime.datetime.strptime(value, CURSOR_TIME_FORMAT)
+    return value, int(row_id)
+
+
+def keyset_order(column, id_column, descending):
+    """ORDER BY for keyset paging, NULLs sort before every other value."""
+    if descending:
+        return [nullslast(desc(column)), desc(id_column)]
+    return [nullsfirst(asc(column)), asc(id_column)]
+
+
+def after_cursor(column, id_column, value, row_id, descending):
+    """The rows that come after (value, row_id) in keyset_order."""
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < row_id)
+        return or_(column < value, and_(column == value, id_column < row_id), column.is_(None))
+    if value is None:
+        return or_(column.isnot(None), id_column > row_id)
+    return or_(column > value, and_(column == value, id_column > row_id))
+
+
+def page_size(default):
+    """The request's count, None unless it is a positive whole number."""
+    if 'count' not in request.args:
+        return default
+    count = request.args.get('count', type=int)
+    if count is None or count < 1:
+        return None
+    return count
+
+
+def load_tag_names(url_ids):
+    tags = {url_id: [] for url_id in url_ids}
+    if not url_ids:
+        return tags
+    rows = DBSession.query(tags_to_urls_table.c.url_id, Tag.name).join(
+        Tag, Tag.id == tags_to_urls_table.c.tag_id
+    ).filter(tags_to_urls_table.c.url_id.in_(url_ids))
+    for url_id, name in rows:
+        tags[url_id].append(name)
+    return tags
+
+
+def page_views(views):
+    """Newest first page of `views` after the request's cursor.
+
+    Returns (views, next_cursor, error), error is set for an invalid count
+    or cursor.
+    """
+    count = page_size(25)
+    if count is None:
+        return None, None, 'count must be a positive whole number'
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            value, row_id = decode_cursor(cursor, 'timestamp')
+        except (ValueError, TypeError):
+            return None, None, 'Invalid cursor'
+        views = views.filter(after_cursor(View.timestamp, View.id, value, row_id, True))
+    views = views.order_by(*keyset_order(View.timestamp, View.id, True)).limit(count).all()
+    next_cursor = None
+    if len(views) == count:
+        next_cursor = encode_cursor(views[-1].timestamp, views[-1].id)
+    return views, next_cursor, None
+
+
 @app.route('/admin/api/shrls')
 @requires_auth
 def get_shrls_api():
     page = int(request.args.get('page', 0))
-    count = int(request.args.get('count', 50))
-    urls = DBSession.query(Url)
+    count = page_size(50)
+    if count is None:
+        return Response('count must be a positive whole number', 400)
+    cursor = request.args.get('cursor')
 
     order_by = request.args.get('order_by')
     sort_by = request.args.get('sort')
@@ -351,67 +662,35 @@ def get_shrls_api():
     order_by = order_by.lower()
     sort_by = sort_by.lower()
 
-    urls = urls.order_by(getattr(getattr(Url, order_by), sort_by)())
+    order_column = getattr(Url, order_by)
+    urls = DBSession.query(Url.id, Url.alias, Url.location, Url.views, order_column.label('cursor_value'))
+    urls = urls.order_by(*keyset_order(order_column, Url.id, sort_by == 'desc'))
 
     searches = request.args.getlist('search')
-
-    t = {
-        '+': [],
-        '-': [],
-        '#': [],
-        '/': [],
-    }
-
-    searches = [[word for word in x.split(' ') if word] for x in searches if x]
-    for search in searches:
-        mode = '+'
-        phrase = []
-        for word in search:
-            if word and word[0] in t.keys():
-                if phrase:
-                    t[mode].append(' '.join(phrase))
-                phrase = []
-                mode = word[0]
-                word = word[1:]
-            if word:
-                phrase.append(word)
-        t[mode].append(' '.join(phrase))
-
-    for f in t['/']:
-        urls = urls.filter(or_(
-            Url.alias.ilike("{}%".format(f)),
-            Url.location.ilike("%/{}%".format(f)),
-        ))
-
-    for f in t['#']:
-        urls = urls.filter(
-            Url.tags.any(Tag.name.ilike("%{}%".format(f)))
-        )
-
-    for f in t['+']:
-        urls = urls.filter(or_(
-            Url.alias.ilike("%{}%".format(f)),
-            Url.location.ilike("%{}%".format(f)),
-            Url.tags.any(Tag.name.ilike("%{}%".format(f))),
-        ))
-
-    for f in t['-']:
-        urls = urls.filter(not_(or_(
-            Url.alias.ilike("%{}%".format(f)),
-            Url.location.ilike("%{}%".format(f)),
-        )))
-
-    urls = urls.offset(page * count)
+    urls = get_search_index().filter(urls, parse_search(searches))
+
+    if cursor:
+        try:
+            value, row_id = decode_cursor(cursor, order_by)
+        except (ValueError, TypeError):
+            return Response('Invalid cursor', 400)
+        urls = urls.filter(after_cursor(order_column, Url.id, value, row_id, sort_by == 'desc'))
+    else:
+        urls = urls.offset(page * count)
     urls = urls.limit(count)
 
     urls = urls.all()
+    tags = load_tag_names([x.id for x in urls])
     final = {'urls': [{
         'id': x.id,
         'alias': x.alias,
         'location': x.location,
-        'views': x.views,
-        'tags': [t.name for t in x.tags],
+        'views': view_counters.with_pending(Url.__table__, x.id, x.views),
+        'tags': tags[x.id],
     } for x in urls]}
+    final['next_cursor'] = None
+    if len(urls) == count:
+        final['next_cursor'] = encode_cursor(urls[-1].cursor_value, urls[-1].id)
 
     return jsonify(final)
 
@@ -435,7 +714,11 @@ def create_url(longurl, shorturl=None, creator=None, shrl_id=None, tags=None):
     shrl = None
     if shrl_id:
         shrl = DBSession.query(Url).filter(Url.id == shrl_id).first()
-    if not shrl:
+    chain_cache.clear()
+    if shrl:
+        alias_cache.invalidate(shrl.alias)
+        tag_cache.invalidate(*[t.name for t in shrl.tags])
+    else:
         shrl = Url(longurl)
     if longurl:
         shrl.location = longurl
@@ -447,6 +730,10 @@ def create_url(longurl, shorturl=None, creator=None, shrl_id=None, tags=None):
         shrl.alias = "{}/{}".format(creator, shrl.alias)
     DBSession.add(shrl)
     DBSession.commit()
+    alias_cache.invalidate(shrl.alias)
+    tag_cache.invalidate(*[t.name for t in shrl.tags])
+    if shorturl or creator:
+        alias_allocator.add(shrl.alias)
     return shrl
     return '{}/{}'.format(app.config['shrls_base_url'], shrl.alias)
 
@@ -465,8 +752,13 @@ def get_tags():
 def delete_shrl():
     shrl_id = request.form.get('id')
     obj = DBSession.query(Url).filter(Url.id == int(shrl_id)).first()
+    tag_cache.invalidate(*[t.name for t in obj.tags])
+    # Its rollups would block the delete through their foreign key
+    DBSession.query(ClickRollup).filter(ClickRollup.urls_id == obj.id).delete(synchronize_session=False)
     DBSession.delete(obj)
     DBSession.commit()
+    alias_cache.invalidate(obj.alias)
+    chain_cache.clear()
     return jsonify({
         'status': 'success',
         'id': shrl_id,
@@ -494,12 +786,89 @@ def post_shrl():
             'id': shrl.id,
             'alias': shrl.alias,
             'location': shrl.location,
-            'views': shrl.views,
+            'views': view_counters.with_pending(Url.__table__, shrl.id, shrl.views),
             'tags': [t.name for t in shrl.tags],
         },
     })
 
 
+def bulk_record_error(record):
+    if not isinstance(record, dict):
+        return 'Expected an object'
+    if not record.get('location') or not isinstance(record['location'], str):
+        return 'Missing location'
+    if record.get('alias') is not None and not isinstance(record['alias'], str):
+        return 'Invalid alias'
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        return 'Invalid tags'
+    return None
+
+
+def create_bulk_urls(batch):
+    """Create one batch of (index, record) in a transaction, returning results."""
+    records = [record for _, record in batch]
+    try:
+        with engine.begin() as conn:
+            created = create_urls(conn, records)
+    except SQLAlchemyError:
+        app.logger.exception('Unable to create %d urls', len(batch))
+        return [{'index': index, 'status': 'error', 'error': 'Database error'} for index, _ in batch]
+    finally:
+        chain_cache.clear()
+        alias_cache.invalidate(*[record['alias'] for record in records if record.get('alias')])
+        tag_cache.invalidate(*set(tag for record in records for tag in record.get('tags') or []))
+    for record in records:
+        if record.get('custom'):
+            alias_allocator.add(record['alias'])
+    return [{
+        'index': index,
+        'status': 'created' if is_new else 'exists',
+        'id': url_id,
+        'alias': record['alias'],
+        'url': u"{}/{}".format(app.config['shrls_base_url'], record['alias']),
+    } for (index, record), (url_id, is_new) in zip(batch, created)]
+
+
+@app.route('/admin/api/shrls/bulk', methods=['POST'])
+@requires_auth
+def post_shrls_bulk():
+    """Create urls from a JSON list or NDJSON of {location, alias, tags}.
+
+    Streams back one NDJSON result per record, tagged with its index.
+    Records with an alias are only created once, records without one are
+    created again by every retry.
+    """
+    batch_size = app.config['shrls_bulk_batch_size']
+
+    def results():
+        batch = []
+        try:
+            for index, (_, record) in enumerate(BackupReader(request.stream, documents=False)):
+                error = bulk_record_error(record)
+                if error:
+                    yield {'index': index, 'status': 'error', 'error': error}
+                    continue
+                batch.append((index, {
+                    'alias': record.get('alias'),
+                    'custom': bool(record.get('alias')),
+                    'location': record['location'],
+                    'tags': record.get('tags') or [],
+                }))
+                if len(batch) >= batch_size:
+                    for result in create_bulk_urls(batch):
+                        yield result
+                    batch = []
+        except ValueError as e:
+            yield {'status': 'error', 'error': 'Invalid JSON: {}'.format(e)}
+        if batch:
+            for result in create_bulk_urls(batch):
+                yield result
+
+    lines = (json.dumps(result) + '\n' for result in results())
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
 
 @app.route('/admin/create', methods=['GET'])
 @requires_auth
@@ -530,7 +899,7 @@ def render_url():
 @app.route('/admin/snippet', methods=['POST'])
 @requires_auth
 def create_snippet():
-    print(request.args)
+    app.logger.debug('Snippet arguments: %s', request.args.to_dict(flat=False))
     content = request.form.get('c')
     title = request.form.get('t')
     shortid = request.form.get('s')
@@ -543,8 +912,10 @@ def create_snippet():
             DBSession.delete(obj)
             DBSession.commit()
         shrl.alias = shortid
+        alias_allocator.add(shortid)
     DBSession.add(shrl)
     DBSession.commit()
+    invalidate_snippet(shrl.alias)
     alias = '{}/c/{}'.format(app.config['shrls_base_url'], shrl.alias)
     shrl = create_url(alias)
     alias = '{}/{}'.format(app.config['shrls_base_url'], shrl.alias)
@@ -560,17 +931,21 @@ def upload_file():
     name = secure_filename(f.filename)
     extension = name.split('.')[-1]
     if not save_as:
-        save_as = ''.join(
-            [random.choice(allowed_shortner_chars) for _ in range(5)]
-        )
+        save_as = create_short_url()
     filename = "{}.{}".format(
         ''.join([x for x in save_as if x in allowed_shortner_chars]),
         extension
     )
-    f.save(os.path.join(
-        app.config['UPLOAD_FOLDER'],
-        filename)
-    )
+    if isinstance(f.stream, IncomingUpload):
+        digest, size = upload_store.commit(f.stream)
+    else:
+        digest, size = upload_store.put(f.stream)
+    upload = DBSession.query(Upload).filter(Upload.name == filename).first()
+    if upload:
+        upload.digest = digest
+        upload.size = size
+    else:
+        DBSession.add(Upload(filename, digest, size))
     alias = "{}/u/{}".format(app.config['shrls_base_url'], filename)
     shrl = create_url(alias, shorturl=save_as)
     alias = '{}/{}'.format(app.config['shrls_base_url'], shrl.alias)
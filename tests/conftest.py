@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import base64
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+# shrls configures itself on import, keep it out of the working directory
+_workdir = tempfile.mkdtemp(prefix='shrls-tests-')
+os.environ['SHRLS_DATABASE_URI'] = 'sqlite:///{}'.format(os.path.join(_workdir, 'urls.db'))
+os.environ['SHRLS_UPLOAD_FOLDER'] = os.path.join(_workdir, 'uploads')
+os.environ['SHRLS_ARCHIVE_FOLDER'] = os.path.join(_workdir, 'archive')
+
+import shrls.views  # noqa: E402 registers the routes
+from shrls import app, models, search  # noqa: E402
+from shrls.cache import alias_cache, chain_cache, tag_cache, snippet_cache  # noqa: E402
+from shrls.counters import view_counters  # noqa: E402
+from shrls.headers import header_codec  # noqa: E402
+from shrls.models import (  # noqa: E402
+    DBSession,
+    ReadSession,
+    alias_allocator,
+    engine_profile,
+    initialize_shrls_db,
+    make_engine,
+)
+from shrls.recorder import click_recorder  # noqa: E402
+
+USERNAME = 'test'
+PASSWORD = 'test'
+
+
+@pytest.fixture(scope='session')
+def postgresql_server():
+    """A PostgreSQL server: SHRLS_TEST_POSTGRESQL_URI, or one run by pgserver."""
+    uri = os.environ.get('SHRLS_TEST_POSTGRESQL_URI')
+    if uri:
+        yield uri
+        return
+    pytest.importorskip('psycopg2')
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(tempfile.mkdtemp(prefix='shrls-pg-'), cleanup_mode='delete')
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def database_uri(request, tmp_path):
+    if request.param == 'sqlite':
+        yield 'sqlite:///{}'.format(tmp_path / 'urls.db')
+        return
+    server_uri = request.getfixturevalue('postgresql_server')
+    admin = create_engine(server_uri, isolation_level='AUTOCOMMIT')
+    name = 'shrls_test_{}'.format(uuid.uuid4().hex[:12])
+    admin.execute('CREATE DATABASE {}'.format(name))
+    url = make_url(server_uri)
+    url.database = name
+    yield str(url)
+    admin.execute('DROP DATABASE {}'.format(name))
+    admin.dispose()
+
+
+def use_engines(monkeypatch, bind, read_bind):
+    """Point every shrls module and singleton at `bind` and `read_bind`."""
+    DBSession.remove()
+    ReadSession.remove()
+    for module in [models, search, shrls.views] + [
+            __import__(name, fromlist=['_']) for name in
+            ['shrls.backup', 'shrls.stats', 'shrls.retention', 'shrls.counters', 'shrls.recorder']]:
+        if hasattr(module, 'engine'):
+            monkeypatch.setattr(module, 'engine', bind)
+    monkeypatch.setattr(models, 'read_engine', read_bind)
+    DBSession.configure(bind=bind)
+    ReadSession.configure(bind=read_bind)
+    for singleton in [alias_allocator, header_codec, click_recorder, view_counters]:
+        monkeypatch.setattr(singleton, 'bind', bind)
+    # Nothing cached from another database may leak into this one
+    monkeypatch.setattr(alias_allocator, '_known', None)
+    monkeypatch.setattr(alias_allocator, '_next', 0)
+    monkeypatch.setattr(alias_allocator, '_end', 0)
+    monkeypatch.setattr(header_codec, '_ids', {})
+    monkeypatch.setattr(header_codec, '_names', {})
+    monkeypatch.setattr(search, '_search_index', None)
+    for cache in [alias_cache, chain_cache, tag_cache, snippet_cache]:
+        cache.clear()
+    # Write clicks and view counts right away so tests can see them
+    monkeypatch.setattr(click_recorder, 'asynchronous', False)
+    monkeypatch.setattr(view_counters, 'asynchronous', False)
+
+
+@pytest.fixture
+def database(database_uri, monkeypatch):
+    """An empty shrls database on each backend, the engine all of shrls now uses."""
+    bind = make_engine(database_uri, **engine_profile)
+    read_bind = make_engine(database_uri, read_only=True, **engine_profile)
+    use_engines(monkeypatch, bind, read_bind)
+    initialize_shrls_db()
+    yield bind
+    DBSession.remove()
+    ReadSession.remove()
+    bind.dispose()
+    read_bind.dispose()
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    monkeypatch.setitem(app.config, 'shrls_users', [
+        {'shrls_username': USERNAME, 'shrls_password': PASSWORD, 'shrls_admin': True},
+    ])
+    return app.test_client()
+
+
+@pytest.fixture
+def auth():
+    credentials = '{}:{}'.format(USERNAME, PASSWORD).encode('utf-8')
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
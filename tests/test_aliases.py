@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import pytest
+
+from shrls.aliases import AliasAllocator
+from shrls.models import AliasSequence, Snippet, Url
+
+
+def every_alias(alphabet, length):
+    return [''.join(letters) for letters in itertools.product(alphabet, repeat=length)]
+
+
+def add_urls(bind, aliases):
+    with bind.begin() as conn:
+        conn.execute(Url.__table__.insert(), [
+            {'alias': alias, 'location': 'http://example.org/', 'views': 0} for alias in aliases
+        ])
+
+
+@pytest.fixture
+def make_allocator(database):
+    def make_allocator(block_size=3):
+        return AliasAllocator(database, AliasSequence.__table__,
+                              [Url.__table__.c.alias, Snippet.__table__.c.alias],
+                              'ab', min_length=3, block_size=block_size)
+    return make_allocator
+
+
+def test_allocated_aliases_are_unique(make_allocator):
+    first, second = make_allocator(), make_allocator()
+    aliases = [allocator.allocate() for _ in range(20) for allocator in (first, second)]
+    aliases += first.allocate_many(10)
+    assert len(set(aliases)) == len(aliases)
+    assert all(set(alias) <= set('ab') for alias in aliases)
+
+
+def test_allocation_skips_custom_aliases(database, make_allocator):
+    custom = every_alias('ab', 3)
+    add_urls(database, custom)
+    aliases = make_allocator().allocate_many(12)
+    assert len(set(aliases)) == 12
+    assert not set(aliases) & set(custom)
+
+
+def test_allocation_skips_custom_aliases_added_later(database, make_allocator):
+    allocator = make_allocator()
+    allocator.allocate()
+    custom = every_alias('ab', 4)
+    add_urls(database, custom)
+    for alias in custom:
+        allocator.add(alias)
+    aliases = [allocator.allocate() for _ in range(10)]
+    assert not set(aliases) & set(custom)
+    assert all(len(alias) == 5 for alias in aliases[-5:])
+
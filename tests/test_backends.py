@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from sqlalchemy import exc, inspect
+
+from shrls.bulk import free_ids, insert_rows
+from shrls.models import (
+    ReadSession,
+    Url,
+    migrate_shrls_db,
+)
+
+
+def test_explicit_ids_move_the_id_sequence(database, client, auth):
+    urls = Url.__table__
+    with database.begin() as conn:
+        insert_rows(conn, urls, [
+            {'id': 10, 'alias': 'ten', 'location': 'http://example.org/10', 'views': 0},
+            {'id': 11, 'alias': 'eleven', 'location': 'http://example.org/11', 'views': 0},
+        ], free_ids(conn, urls, [10, 11]))
+    response = client.post('/admin/api/shrls', headers=auth, data={'location': 'http://example.org/new'})
+    assert response.status_code == 200
+    assert response.get_json()['shrl']['id'] == 12
+
+
+def test_read_sessions_cannot_write(database):
+    ReadSession.add(Url('http://example.org/', alias='readonly'))
+    with pytest.raises(exc.DBAPIError):
+        ReadSession.commit()
+    ReadSession.rollback()
+    assert ReadSession.query(Url).count() == 0
+
+
+def test_migration_adds_missing_columns(database):
+    with database.begin() as conn:
+        conn.execute('ALTER TABLE alias_sequence DROP COLUMN secret')
+    migrate_shrls_db()
+    columns = [column['name'] for column in inspect(database).get_columns('alias_sequence')]
+    assert 'secret' in columns
+    # Running it again on an up to date database changes nothing
+    migrate_shrls_db()
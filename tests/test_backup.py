@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import zlib
+
+import pytest
+
+from shrls.backup import BackupReader
+from shrls.models import Snippet, Tag, Url, tags_to_urls_table
+
+
+@pytest.fixture
+def shrls(client, auth):
+    for alias, location, tags in [
+        ('docs', 'http://example.org/docs', ['work', 'docs']),
+        ('blog', 'http://example.org/blog', []),
+        ('same', 'http://example.org/1', ['work']),
+        ('same', 'http://example.org/2', []),
+    ]:
+        response = client.post('/admin/api/shrls', headers=auth,
+                               data={'location': location, 'alias': alias, 'tags[]': tags})
+        assert response.status_code == 200
+    client.post('/admin/snippet', headers=auth, data={'c': 'print("hello")', 't': 'hello', 's': 'hello'})
+
+
+def download(client, auth, query=''):
+    response = client.get('/admin/backup/' + query, headers=auth)
+    assert response.status_code == 200
+    return response.get_data()
+
+
+def records(backup):
+    """Every (kind, record) in a backup, ignoring the order and the row ids."""
+    found = []
+    for kind, record in BackupReader(io.BytesIO(backup)):
+        record = dict(record, tags=sorted(record.get('tags', [])))
+        record.pop('id')
+        found.append((kind, json.dumps(record, sort_keys=True)))
+    return sorted(found)
+
+
+def empty(bind):
+    with bind.begin() as conn:
+        for table in [tags_to_urls_table, Tag.__table__, Url.__table__, Snippet.__table__]:
+            conn.execute(table.delete())
+
+
+@pytest.mark.parametrize('query', ['', '?format=ndjson', '?compress=gzip', '?format=ndjson&compress=gzip'])
+def test_backup_restores_into_an_empty_database(client, auth, database, shrls, query):
+    backup = download(client, auth, query)
+    if 'gzip' in query:
+        assert zlib.decompress(backup, 16 + zlib.MAX_WBITS)
+    expected = records(backup)
+    # Four urls, the snippet and the url pointing at it
+    assert len(expected) == 6
+    empty(database)
+    assert records(download(client, auth)) == []
+    response = client.post('/admin/restore/?progress=1', headers=auth, content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(backup), 'backup')})
+    progress = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert progress[-1] == {'urls': 5, 'snippets': 1, 'updated': 0, 'done': True}
+    assert records(download(client, auth, query)) == expected
+
+
+def test_restoring_twice_does_not_duplicate(client, auth, shrls):
+    backup = download(client, auth, '?format=ndjson')
+    expected = records(backup)
+    response = client.post('/admin/restore/', headers=auth, content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(backup), 'backup')})
+    assert response.status_code == 302
+    assert records(download(client, auth)) == expected
+
+
+def test_restored_urls_redirect(client, auth, database, shrls):
+    backup = download(client, auth)
+    empty(database)
+    client.post('/admin/restore/', headers=auth, content_type='multipart/form-data',
+                data={'file': (io.BytesIO(backup), 'backup')})
+    response = client.get('/docs', environ_base={'HTTP_X_REAL_IP': '203.0.113.1'})
+    assert response.location == 'http://example.org/docs'
+    response = client.post('/admin/api/shrls', headers=auth, data={'location': 'http://example.org/new'})
+    assert response.status_code == 200
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from shrls.models import DBSession, Url
+
+
+def post_bulk(client, auth, records):
+    body = ''.join(json.dumps(record) + '\n' for record in records)
+    response = client.post('/admin/api/shrls/bulk', headers=auth, data=body,
+                           content_type='application/x-ndjson')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def tag_names(alias):
+    url = DBSession.query(Url).filter_by(alias=alias).one()
+    return sorted(tag.name for tag in url.tags)
+
+
+def test_bulk_accepts_records_that_start_with_tags(client, auth):
+    results = post_bulk(client, auth, [
+        {'tags': ['x'], 'location': 'http://example.org/1', 'alias': 'first'},
+        {'tags': ['x', 'y'], 'location': 'http://example.org/2', 'alias': 'second'},
+    ])
+    assert [result['status'] for result in results] == ['created', 'created']
+    assert tag_names('first') == ['x']
+    assert tag_names('second') == ['x', 'y']
+
+
+def test_bulk_accepts_a_json_list(client, auth):
+    response = client.post('/admin/api/shrls/bulk', headers=auth, content_type='application/json',
+                           data=json.dumps([{'tags': ['x'], 'location': 'http://example.org/'}]))
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [result['status'] for result in results] == ['created']
+
+
+def test_bulk_retries_do_not_duplicate_aliased_records(client, auth):
+    records = [
+        {'location': 'http://example.org/1', 'alias': 'once'},
+        {'location': 'http://example.org/2'},
+    ]
+    first = post_bulk(client, auth, records)
+    second = post_bulk(client, auth, records)
+    assert [result['status'] for result in first] == ['created', 'created']
+    assert [result['status'] for result in second] == ['exists', 'created']
+    assert second[0]['id'] == first[0]['id']
+    assert DBSession.query(Url).filter_by(alias='once').count() == 1
+    assert second[1]['alias'] != first[1]['alias']
+
+
+def test_bulk_reports_bad_records_and_keeps_going(client, auth):
+    results = post_bulk(client, auth, [
+        {'alias': 'nowhere'},
+        {'location': 'http://example.org/', 'tags': 'x'},
+        {'location': 'http://example.org/', 'alias': 'fine'},
+    ])
+    assert [result['status'] for result in results] == ['error', 'error', 'created']
+    assert [result['index'] for result in results] == [0, 1, 2]
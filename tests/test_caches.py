@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from shrls import app
+from shrls.cache import LRUCache, alias_cache, snippet_cache, tag_cache
+
+REAL_IP = {'HTTP_X_REAL_IP': '203.0.113.1'}
+
+
+@pytest.fixture
+def visit(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'shrls_redirect_unknown', False)
+    monkeypatch.setitem(app.config, 'shrls_base_url', 'http://shr.ls')
+
+    def visit(path):
+        return client.get(path, environ_base=REAL_IP)
+    return visit
+
+
+def save(client, auth, **form):
+    response = client.post('/admin/api/shrls', headers=auth, data=form)
+    assert response.status_code == 200
+    return response.get_json()['shrl']
+
+
+def test_lru_cache_evicts_and_expires(monkeypatch):
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('a') is None
+
+
+def test_redirects_follow_edits(client, auth, visit):
+    shrl = save(client, auth, location='http://example.org/old', alias='moving')
+    assert visit('/moving').location == 'http://example.org/old'
+    assert 'moving' in alias_cache
+    save(client, auth, id=shrl['id'], location='http://example.org/new')
+    assert visit('/moving').location == 'http://example.org/new'
+
+
+def test_new_urls_join_a_cached_alias(client, auth, visit):
+    assert visit('/shared').status_code == 404
+    save(client, auth, location='http://example.org/', alias='shared')
+    assert visit('/shared').location == 'http://example.org/'
+
+
+def test_deleted_urls_stop_redirecting(client, auth, visit):
+    shrl = save(client, auth, location='http://example.org/', alias='doomed', **{'tags[]': ['gone']})
+    assert visit('/doomed').status_code == 302
+    assert visit('/t/gone').status_code == 302
+    response = client.delete('/admin/api/shrls', headers=auth, data={'id': shrl['id']})
+    assert response.status_code == 200
+    assert visit('/doomed').status_code == 404
+    assert visit('/t/gone').status_code == 404
+
+
+def test_tag_redirects_see_new_urls(client, auth, visit):
+    first = save(client, auth, location='http://example.org/1', alias='first', **{'tags[]': ['docs']})
+    assert visit('/t/docs').location == 'http://example.org/1'
+    assert 'docs' in tag_cache
+    save(client, auth, location='http://example.org/2', alias='second', **{'tags[]': ['docs']})
+    response = client.delete('/admin/api/shrls', headers=auth, data={'id': first['id']})
+    assert response.status_code == 200
+    assert visit('/t/docs').location == 'http://example.org/2'
+
+
+def test_redirect_chains_follow_edits(client, auth, visit):
+    # Tag redirects flatten chains through our own aliases
+    save(client, auth, location='http://shr.ls/target', alias='hop', **{'tags[]': ['chain']})
+    target = save(client, auth, location='http://example.org/old', alias='target')
+    assert visit('/t/chain').location == 'http://example.org/old'
+    save(client, auth, id=target['id'], location='http://example.org/new')
+    assert visit('/t/chain').location == 'http://example.org/new'
+
+
+def test_snippets_are_rendered_again_after_an_edit(client, auth, visit):
+    client.post('/admin/snippet', headers=auth, data={'c': 'first', 's': 'snip'})
+    response = visit('/c/snip.txt')
+    assert response.get_data(as_text=True) == 'first'
+    assert ('snip', 'txt') in snippet_cache
+    assert visit('/c/snip.txt').status_code == 200
+    client.post('/admin/snippet', headers=auth, data={'c': 'second', 's': 'snip'})
+    etag = response.headers['ETag']
+    response = client.get('/c/snip.txt', headers={'If-None-Match': etag}, environ_base=REAL_IP)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'second'
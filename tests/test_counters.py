@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from shrls.counters import ShardedCounter, ViewCounters
+from shrls.models import Url
+
+URLS = Url.__table__
+
+
+@pytest.fixture
+def counters(database):
+    with database.begin() as conn:
+        conn.execute(URLS.insert(), [
+            {'id': 1, 'alias': 'one', 'location': 'http://example.org/', 'views': 5},
+            {'id': 2, 'alias': 'two', 'location': 'http://example.org/', 'views': None},
+        ])
+    counters = ViewCounters(database, shards=4, flush_interval=0.01)
+    yield counters
+    counters.stop()
+
+
+def stored_views(bind):
+    with bind.connect() as conn:
+        return dict(conn.execute(select([URLS.c.id, URLS.c.views]).order_by(URLS.c.id)).fetchall())
+
+
+def test_sharded_counter_drains_everything():
+    counter = ShardedCounter(shards=4)
+    counter.update({'a': 2, 'b': 1})
+    counter.add('a')
+    assert counter.get('a') == 3
+    assert counter.drain() == {'a': 3, 'b': 1}
+    assert counter.drain() == {}
+
+
+def test_hits_are_pending_until_flushed(database, counters):
+    counters.counts.add((URLS, 1), 3)
+    counters.counts.add((URLS, 2))
+    assert counters.with_pending(URLS, 1, 5) == 8
+    assert stored_views(database) == {1: 5, 2: None}
+    counters.flush()
+    assert stored_views(database) == {1: 8, 2: 1}
+    assert counters.pending(URLS, 1) == 0
+
+
+def test_failed_flushes_keep_their_hits(database, counters):
+    counters.counts.add((URLS, 1), 3)
+
+    def fail(counts):
+        raise RuntimeError('database is gone')
+
+    counters.write = fail
+    with pytest.raises(RuntimeError):
+        counters.flush()
+    assert counters.pending(URLS, 1) == 3
+    del counters.write
+    counters.flush()
+    assert stored_views(database)[1] == 8
+
+
+def test_no_hits_are_lost_while_flushing(database, counters):
+    threads = [threading.Thread(target=lambda: [counters.hit_url(1, 2) for _ in range(200)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counters.stop()
+    assert stored_views(database) == {1: 805, 2: 800}
+    assert counters.failed == 0
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.seed import seed, make_alias
+from shrls.models import Url
+
+# Statements the info endpoints may run, whatever the page size
+MAX_QUERIES = 5
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', count)
+    yield executed
+    event.remove(Engine, 'before_cursor_execute', count)
+
+
+@pytest.fixture
+def shared_alias(database):
+    seed(database, urls=50, tags=10, tags_per_url=4, views=500, headers_per_view=3, snippets=0)
+    alias = make_alias(1)
+    urls = Url.__table__
+    with database.begin() as conn:
+        conn.execute(urls.update().where(urls.c.id.in_([2, 3, 4])).values(alias=alias))
+    return alias
+
+
+@pytest.mark.parametrize('path', ['/admin/info/', '/admin/info/{alias}'])
+def test_info_query_count_is_bounded(client, auth, shared_alias, statements, path):
+    path = path.format(alias=shared_alias)
+    # Warm up the header name lookup so only the endpoint is counted
+    assert client.get(path, headers=auth).status_code == 200
+    counts = {}
+    for size in [1, 200]:
+        del statements[:]
+        response = client.get('{}?count={}'.format(path, size), headers=auth)
+        assert response.status_code == 200
+        counts[size] = len(statements)
+    assert counts[200] <= counts[1]
+    assert counts[200] <= MAX_QUERIES
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from sqlalchemy import inspect, select
+
+from shrls import app
+from shrls.headers import header_codec
+from shrls.models import Url, View, legacy_headers_table, migrate_header_rows, migrate_shrls_db
+
+
+@pytest.fixture
+def legacy_views(database):
+    """Three clicks stored the old way, one headers row per request header."""
+    legacy_headers_table.create(bind=database)
+    with database.begin() as conn:
+        conn.execute(Url.__table__.insert(), {'id': 1, 'alias': 'old', 'location': 'http://example.org/', 'views': 3})
+        conn.execute(View.__table__.insert(), [
+            {'id': view_id, 'urls_id': 1, 'ip': '203.0.113.1', 'request': '/old'} for view_id in [1, 2, 3]
+        ])
+        conn.execute(legacy_headers_table.insert(), [
+            {'views_id': 1, 'key': 'Cookie', 'value': 'a=1'},
+            {'views_id': 1, 'key': 'Accept', 'value': '*/*'},
+            {'views_id': 2, 'key': 'Cookie', 'value': 'a=2'},
+            {'views_id': 3, 'key': 'User-Agent', 'value': 'curl/7.0'},
+            {'views_id': 3, 'key': 'Cookie', 'value': 'a=3'},
+        ])
+    return database
+
+
+def migrated_headers(bind):
+    views = View.__table__
+    with bind.connect() as conn:
+        rows = conn.execute(select([views.c.id, views.c.header_data]).order_by(views.c.id)).fetchall()
+    return {view_id: header_codec.decode(header_data) for view_id, header_data in rows}
+
+
+def test_migration_keeps_every_legacy_header_by_default(legacy_views):
+    migrate_shrls_db()
+    assert migrated_headers(legacy_views) == {
+        1: {'Cookie': 'a=1', 'Accept': '*/*'},
+        2: {'Cookie': 'a=2'},
+        3: {'User-Agent': 'curl/7.0', 'Cookie': 'a=3'},
+    }
+    assert legacy_headers_table.name not in inspect(legacy_views).get_table_names()
+
+
+def test_migration_can_keep_only_the_recorded_headers(legacy_views, monkeypatch):
+    monkeypatch.setitem(app.config, 'shrls_migrate_recorded_headers_only', True)
+    migrate_shrls_db()
+    assert migrated_headers(legacy_views) == {1: {}, 2: {}, 3: {'User-Agent': 'curl/7.0'}}
+
+
+def test_migration_handles_batches_without_recorded_headers(legacy_views, monkeypatch):
+    monkeypatch.setitem(app.config, 'shrls_migrate_recorded_headers_only', True)
+    # Views 1 and 2 only have Cookie and Accept headers, so their batch packs nothing
+    with legacy_views.begin() as conn:
+        migrate_header_rows(conn, batch_size=2)
+    assert migrated_headers(legacy_views) == {1: {}, 2: {}, 3: {'User-Agent': 'curl/7.0'}}
+    assert legacy_headers_table.name not in inspect(legacy_views).get_table_names()
+    # Nothing is left to migrate the second time
+    migrate_shrls_db()
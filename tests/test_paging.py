@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from shrls.models import Url, View
+
+EARLY = datetime.datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def urls(database):
+    """Six urls, two of them from before created_at was recorded."""
+    created = [None, EARLY, None, EARLY, EARLY + datetime.timedelta(days=1), EARLY]
+    with database.begin() as conn:
+        conn.execute(Url.__table__.insert(), [{
+            'id': url_id,
+            'alias': 'url{}'.format(url_id),
+            'location': 'http://example.org/{}'.format(url_id),
+            'views': 0,
+            'created_at': created_at,
+        } for url_id, created_at in enumerate(created, 1)])
+    return created
+
+
+def list_all(client, auth, path, key, count):
+    """Every row of a cursor paged endpoint, one list per page."""
+    pages = []
+    cursor = None
+    while True:
+        query = '{}{}count={}'.format(path, '&' if '?' in path else '?', count)
+        if cursor:
+            query += '&cursor={}'.format(cursor)
+        response = client.get(query, headers=auth)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append(data[key])
+        cursor = data['next_cursor']
+        if not cursor:
+            return pages
+
+
+@pytest.mark.parametrize('sort, expected', [
+    ('asc', [1, 3, 2, 4, 6, 5]),
+    ('desc', [5, 6, 4, 2, 3, 1]),
+])
+@pytest.mark.parametrize('count', [1, 2, 4])
+def test_listing_pages_over_null_created_at(client, auth, urls, sort, expected, count):
+    pages = list_all(client, auth, '/admin/api/shrls?order_by=created_at&sort={}'.format(sort), 'urls', count)
+    assert [url['id'] for page in pages for url in page] == expected
+    assert all(len(page) <= count for page in pages)
+
+
+@pytest.mark.parametrize('count', ['0', '-1', 'abc'])
+def test_listing_rejects_page_sizes_below_one(client, auth, urls, count):
+    response = client.get('/admin/api/shrls?count={}'.format(count), headers=auth)
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def views(urls, database):
+    """Five clicks on url1, two of them without a timestamp."""
+    timestamps = [EARLY, None, EARLY + datetime.timedelta(hours=1), None, EARLY]
+    with database.begin() as conn:
+        conn.execute(View.__table__.insert(), [
+            {'id': view_id, 'urls_id': 1, 'timestamp': timestamp, 'ip': '203.0.113.1', 'request': '/url1'}
+            for view_id, timestamp in enumerate(timestamps, 1)
+        ])
+    return timestamps
+
+
+@pytest.mark.parametrize('count', [1, 2, 3])
+def test_info_pages_over_null_timestamps(client, auth, views, count):
+    pages = list_all(client, auth, '/admin/info/', 'requests', count)
+    assert [view['id'] for page in pages for view in page] == [3, 5, 1, 4, 2]
+    # Requests of a url are keyed by id, so only check each is listed once
+    pages = list_all(client, auth, '/admin/info/url1', 'urls', count)
+    assert sorted(int(view_id) for page in pages for view_id in page[0]['requests']) == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('path', ['/admin/info/', '/admin/info/url1'])
+@pytest.mark.parametrize('count', ['0', '-1', 'abc'])
+def test_info_rejects_page_sizes_below_one(client, auth, views, path, count):
+    response = client.get('{}?count={}'.format(path, count), headers=auth)
+    assert response.status_code == 400
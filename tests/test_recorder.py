@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from sqlalchemy import select
+
+from shrls.models import ClickRollup, Url, View
+from shrls.recorder import Click, ClickRecorder
+
+
+def add_urls(bind, *ids):
+    with bind.begin() as conn:
+        conn.execute(Url.__table__.insert(), [
+            {'id': url_id, 'alias': 'url{}'.format(url_id), 'location': 'http://example.org/', 'views': 0}
+            for url_id in ids
+        ])
+
+
+def recorded_url_ids(bind):
+    views = View.__table__
+    with bind.connect() as conn:
+        return sorted(row[0] for row in conn.execute(select([views.c.urls_id])))
+
+
+def click(urls_id):
+    return Click(datetime.datetime.now(), urls_id, '203.0.113.1', '/', [('User-Agent', 'curl/7.0')])
+
+
+def test_recorder_keeps_the_batch_when_a_url_was_deleted(database):
+    add_urls(database, 1, 2)
+    recorder = ClickRecorder(database, asynchronous=False)
+    with database.begin() as conn:
+        conn.execute(Url.__table__.delete().where(Url.__table__.c.id == 1))
+    recorder.put([click(1), click(2), click(2)])
+    assert recorded_url_ids(database).count(2) == 2
+    # Only PostgreSQL enforces the views.urls_id foreign key
+    if database.dialect.name == 'postgresql':
+        assert recorded_url_ids(database) == [2, 2]
+        assert recorder.failed == 1
+
+
+def test_recorder_writes_queued_clicks_on_flush(database):
+    add_urls(database, 1, 2)
+    recorder = ClickRecorder(database, batch_size=2, flush_interval=0.01)
+    try:
+        recorder.put([click(1), click(2), click(2)])
+        recorder.flush()
+        assert recorded_url_ids(database) == [1, 2, 2]
+        recorder.put([click(1)])
+    finally:
+        recorder.stop()
+    assert recorded_url_ids(database) == [1, 1, 2, 2]
+    assert recorder.failed == 0
+
+
+def test_recorder_counts_clicks_it_has_no_room_for(database, monkeypatch):
+    add_urls(database, 1)
+    recorder = ClickRecorder(database, maxsize=2)
+    monkeypatch.setattr(recorder, 'start', lambda: None)
+    recorder.put([click(1), click(1), click(1)])
+    assert recorder.dropped == 1
+    assert recorder.queue.qsize() == 2
+
+
+def test_recorder_rolls_up_clicks(database):
+    add_urls(database, 1)
+    recorder = ClickRecorder(database, asynchronous=False)
+    recorder.put([click(1), click(1)])
+    rollups = ClickRollup.__table__
+    with database.connect() as conn:
+        clicks = conn.execute(
+            select([rollups.c.clicks])
+            .where(rollups.c.urls_id == 1)
+            .where(rollups.c.granularity == 'hour')
+            .where(rollups.c.dimension == 'total')
+        ).scalar()
+    assert clicks == 2
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from shrls import app, search
+from shrls.models import DBSession, Url, search_index_available
+from shrls.search import Fts5SearchIndex, LikeSearchIndex, parse_search
+
+SEARCHES = [
+    'docs', 'DOCS', 'do', 'example', 'wiki/page', '"quote', 'status page', '#work', '#ork', '#wo',
+    '/doc', '/internal', '-docs', '-do', 'example -blog', '#work -status', 'example.org/wiki #team',
+    'nothing matches this',
+]
+
+
+@pytest.fixture
+def urls(client, auth, database):
+    if database.dialect.name != 'sqlite':
+        pytest.skip('FTS5 is SQLite only')
+    with database.connect() as conn:
+        if not search_index_available(conn):
+            pytest.skip('SQLite is built without the FTS5 trigram tokenizer')
+    for alias, location, tags in [
+        ('docs', 'http://example.org/docs/index', ['work', 'docs']),
+        ('blog', 'http://blog.example.org/2020/"quoted"', []),
+        ('wiki', 'http://example.org/wiki/page', ['team', 'work']),
+        ('status', 'http://status.internal/page', ['ops']),
+        ('Docs2', 'http://internal/doc', ['Work']),
+    ]:
+        response = client.post('/admin/api/shrls', headers=auth,
+                               data={'location': location, 'alias': alias, 'tags[]': tags})
+        assert response.status_code == 200
+    assert isinstance(search.get_search_index(), Fts5SearchIndex)
+
+
+def found(index, searches):
+    query = index.filter(DBSession.query(Url.id), parse_search(searches))
+    return sorted(url_id for (url_id,) in query)
+
+
+@pytest.mark.parametrize('searches', [[s] for s in SEARCHES] + [['docs', '#work'], ['-wiki', '/status']])
+def test_fts5_finds_what_like_finds(urls, searches):
+    assert found(Fts5SearchIndex(), searches) == found(LikeSearchIndex(), searches)
+
+
+def test_fts5_follows_edits_and_deletes(client, auth, urls):
+    client.post('/admin/api/shrls', headers=auth,
+                data={'id': 1, 'location': 'http://example.org/manual', 'tags[]': ['handbook']})
+    client.delete('/admin/api/shrls', headers=auth, data={'id': 3})
+    for searches in [['docs'], ['manual'], ['#handbook'], ['#work'], ['wiki']]:
+        assert found(Fts5SearchIndex(), searches) == found(LikeSearchIndex(), searches)
+    assert found(Fts5SearchIndex(), ['#handbook']) == [1]
+    assert found(Fts5SearchIndex(), ['wiki']) == []
+
+
+def test_listing_api_uses_the_index(client, auth, urls):
+    response = client.get('/admin/api/shrls?search=example%20-blog', headers=auth)
+    assert sorted(url['alias'] for url in response.get_json()['urls']) == ['docs', 'wiki']
+
+
+def test_searches_use_like_without_the_index(client, auth, monkeypatch):
+    monkeypatch.setitem(app.config, 'shrls_search_index', None)
+    client.post('/admin/api/shrls', headers=auth, data={'location': 'http://example.org/docs', 'alias': 'docs'})
+    assert type(search.get_search_index()) is LikeSearchIndex
+    response = client.get('/admin/api/shrls?search=docs', headers=auth)
+    assert [url['alias'] for url in response.get_json()['urls']] == ['docs']
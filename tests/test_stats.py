@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from shrls import app
+
+
+@pytest.fixture
+def alias(client, auth):
+    response = client.post('/admin/api/shrls', headers=auth,
+                           data={'location': 'http://example.org/', 'alias': 'stats'})
+    assert response.status_code == 200
+    return 'stats'
+
+
+@pytest.mark.parametrize('days', ['abc', '1.5', ''])
+def test_stats_rejects_days_that_are_not_whole_numbers(client, auth, alias, days):
+    response = client.get('/admin/api/stats/{}?days={}'.format(alias, days), headers=auth)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('days, expected', [
+    ('-5', 1),
+    ('0', 1),
+    ('7', 7),
+    ('1000000000', app.config['shrls_stats_max_days']),
+])
+def test_stats_clamps_days(client, auth, alias, days, expected):
+    response = client.get('/admin/api/stats/{}?days={}&granularity=hour'.format(alias, days), headers=auth)
+    assert response.status_code == 200
+    since = datetime.datetime.strptime(response.get_json()['since'], '%a, %d %b %Y %H:%M:%S GMT')
+    ago = datetime.datetime.now() - since
+    assert datetime.timedelta(days=expected) <= ago < datetime.timedelta(days=expected, hours=2)
+
+
+def test_urls_with_clicks_can_be_deleted(client, auth, alias):
+    response = client.get('/' + alias, environ_base={'HTTP_X_REAL_IP': '203.0.113.1'})
+    assert response.status_code == 302
+    response = client.get('/admin/api/stats/{}?granularity=hour'.format(alias), headers=auth)
+    assert sum(row['clicks'] for row in response.get_json()['stats']) == 1
+    url_id = client.get('/admin/info/' + alias, headers=auth).get_json()['urls'][0]['id']
+    response = client.delete('/admin/api/shrls', headers=auth, data={'id': url_id})
+    assert response.status_code == 200
+    response = client.get('/admin/info/' + alias, headers=auth)
+    assert response.get_json()['urls'] == []
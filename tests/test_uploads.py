@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import hashlib
+
+import pytest
+
+from shrls.uploads import upload_store
+
+
+def upload(client, auth, content, name='notes'):
+    response = client.post('/admin/upload', headers=auth, content_type='multipart/form-data', data={
+        'file': (io.BytesIO(content), 'notes.txt'),
+        's': name,
+    })
+    assert response.status_code == 200
+    return '/u/{}.txt'.format(name)
+
+
+def test_upload_is_stored_under_its_digest(client, auth):
+    path = upload(client, auth, b'first version')
+    digest = hashlib.sha256(b'first version').hexdigest()
+    assert upload_store.exists(digest)
+    response = client.get(path)
+    assert response.get_data() == b'first version'
+    assert response.headers['ETag'] == '"{}"'.format(digest)
+    assert client.get(path, headers={'If-None-Match': '"{}"'.format(digest)}).status_code == 304
+
+
+def test_named_uploads_are_revalidated(client, auth):
+    path = upload(client, auth, b'first version')
+    response = client.get(path)
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert 'Expires' not in response.headers
+    upload(client, auth, b'second version')
+    response = client.get(path, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_data() == b'second version'
+
+
+def test_digest_addressed_uploads_are_cached(client, auth):
+    path = upload(client, auth, b'first version')
+    digest = hashlib.sha256(b'first version').hexdigest()
+    response = client.get('{}?v={}'.format(path, digest))
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    # A digest that is no longer current is not cached
+    upload(client, auth, b'second version')
+    response = client.get('{}?v={}'.format(path, digest))
+    assert response.get_data() == b'second version'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+@pytest.fixture
+def small_uploads(monkeypatch):
+    monkeypatch.setattr(upload_store, 'max_size', 10)
+
+
+def test_large_uploads_are_refused(client, auth, small_uploads):
+    response = client.post('/admin/upload', headers=auth, content_type='multipart/form-data', data={
+        'file': (io.BytesIO(b'x' * 11), 'big.txt'),
+    })
+    assert response.status_code == 413